@@ -0,0 +1,276 @@
+import numpy as np
+import pandas as pd
+
+from babs_visualizations import filter_mask, parse_condition, histogram_bins
+
+CHUNK_SIZE = 200000
+
+# Quartiles reported by usage_stats.
+QUARTILES = [.25, .5, .75]
+
+class KLLSketch(object):
+    """
+    KLL quantile sketch (Karnin, Lang and Liberty, 2016) of a stream of
+    numbers, in a few thousand values whatever the length of the stream.
+
+    Values are kept in levels of compactors: a value at level h stands for
+    2**h values of the stream. When the levels hold more than their capacity,
+    the lowest full one is sorted and every other value of it, starting from
+    the first or second at random, moves up a level. Sketches of parts of a
+    stream can be merged into a sketch of the whole.
+
+    Error bound: the rank of a quantile returned is, with 99% confidence,
+    within 1.65% of the number of values of the rank asked for, with the
+    default k = 200 (the bound of the reference implementation, Apache
+    DataSketches, whose compactor capacities are the same). For example, the
+    median returned is between the 48.35th and the 51.65th percentiles. The
+    error shrinks about in proportion to 1 / k. Counts and the minimum and
+    maximum are exact.
+    """
+
+    # Each level below the top holds 2/3 of the capacity of the one above.
+    DECAY = 2. / 3
+
+    MIN_CAPACITY = 8
+
+    def __init__(self, k = 200, seed = None):
+        self.k = k
+        self.n = 0
+        self.min = np.nan
+        self.max = np.nan
+        self.levels = [np.empty(0)]
+        self.random = np.random.RandomState(seed)
+
+    def __len__(self):
+        return self.n
+
+    def capacity(self, level):
+        depth = len(self.levels) - 1 - level
+        return max(self.MIN_CAPACITY, int(np.ceil(self.k * self.DECAY ** depth)))
+
+    def update(self, values):
+        """
+        Add an array of values to the sketch. Missing values are ignored.
+        """
+        values = np.asarray(values, dtype = float)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.n += len(values)
+        self.min = np.nanmin([self.min, values.min()])
+        self.max = np.nanmax([self.max, values.max()])
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compress()
+
+    def merge(self, other):
+        """
+        Add the values summarised by another sketch to this one.
+        """
+        if not other.n:
+            return
+        self.n += other.n
+        self.min = np.nanmin([self.min, other.min])
+        self.max = np.nanmax([self.max, other.max])
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, values in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], values])
+        self.compress()
+
+    def compress(self):
+        while sum(len(values) for values in self.levels) > \
+                sum(self.capacity(h) for h in range(len(self.levels))):
+            h = next(h for h in range(len(self.levels))
+                     if len(self.levels[h]) >= self.capacity(h))
+            if h == len(self.levels) - 1:
+                self.levels.append(np.empty(0))
+            values = np.sort(self.levels[h])
+            # an odd one out stays at this level
+            keep = len(values) % 2
+            offset = self.random.randint(2)
+            self.levels[h] = values[:keep]
+            self.levels[h + 1] = np.concatenate(
+                [self.levels[h + 1], values[keep + offset::2]])
+
+    def quantiles(self, qs):
+        """
+        Approximate quantiles of the values added, for a list of fractions
+        between 0 and 1 (see the error bound above).
+        """
+        if not self.n:
+            return np.full(len(qs), np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** h)
+                                  for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind = 'stable')
+        values, ranks = values[order], np.cumsum(weights[order])
+        result = values[np.minimum(np.searchsorted(ranks, np.asarray(qs) * ranks[-1]),
+                                   len(values) - 1)]
+        result[np.asarray(qs) <= 0] = self.min
+        result[np.asarray(qs) >= 1] = self.max
+        return result
+
+def is_parquet(source):
+    return source.endswith('.parquet') or source.endswith('.pq')
+
+def source_columns(source):
+    """
+    Column names of a trip data file, read from its header alone.
+    """
+    if is_parquet(source):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(source).schema_arrow.names
+    return list(pd.read_csv(source, nrows = 0).columns)
+
+def iter_chunks(sources, fields, chunksize = CHUNK_SIZE):
+    """
+    Data frames of up to chunksize trips, with the columns in fields only,
+    from a CSV or Parquet file (by its extension, .parquet or .pq) or a list
+    of them. Only one chunk is held in memory at a time.
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+    for source in sources:
+        columns = source_columns(source)
+        for field in fields:
+            if field not in columns:
+                raise Exception("'{}' is not a feature of the data in '{}'. Did you spell something wrong?".format(field, source))
+        if is_parquet(source):
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(source).iter_batches(
+                    batch_size = chunksize, columns = fields):
+                yield batch.to_pandas()
+        else:
+            for chunk in pd.read_csv(source, usecols = fields,
+                                     chunksize = chunksize):
+                yield chunk
+
+def filter_fields(filters):
+    """
+    Names of the fields tested by the filter conditions.
+    """
+    if isinstance(filters, str):
+        filters = [filters]
+    return [parse_condition(condition)[0] for condition in filters]
+
+def unique_fields(*fields):
+    return list(dict.fromkeys(fields))
+
+def stream_usage_stats(sources, filters = [], verbose = True, group_by = None,
+                       chunksize = CHUNK_SIZE):
+    """
+    usage_stats over trip data files too large to load at once (see
+    iter_chunks), in one pass over them, applying the filters chunk by chunk.
+    Counts and the mean duration are exact; quartiles are approximate, from a
+    KLLSketch of the durations (within 1.65% in rank, with 99% confidence).
+    """
+    if group_by:
+        return stream_grouped_usage_stats(sources, group_by, filters, verbose,
+                                          chunksize)
+
+    n_data_all = 0
+    n_data = 0
+    duration_sum = 0.
+    sketch = KLLSketch()
+    fields = unique_fields('duration', *filter_fields(filters))
+    for chunk in iter_chunks(sources, fields, chunksize):
+        n_data_all += chunk.shape[0]
+        durations = chunk['duration'].values[filter_mask(chunk, filters)]
+        n_data += len(durations)
+        duration_sum += durations.sum()
+        sketch.update(durations)
+
+    duration_mean = duration_sum / n_data if n_data else np.nan
+    duration_qtiles = sketch.quantiles(QUARTILES)
+
+    if verbose:
+        if filters:
+            print('There are {:d} data points ({:.2f}%) matching the filter criteria.'.format(n_data, 100. * n_data / n_data_all))
+        else:
+            print('There are {:d} data points in the dataset.'.format(n_data))
+
+        print('The average duration of trips is {:.2f} minutes.'.format(duration_mean))
+        print('The median trip duration is about {:.2f} minutes.'.format(duration_qtiles[1]))
+        print('25% of trips are shorter than about {:.2f} minutes.'.format(duration_qtiles[0]))
+        print('25% of trips are longer than about {:.2f} minutes.'.format(duration_qtiles[2]))
+
+    return duration_qtiles
+
+def stream_grouped_usage_stats(sources, group_by, filters = [], verbose = True,
+                               chunksize = CHUNK_SIZE):
+    """
+    grouped_usage_stats over trip data files too large to load at once, with
+    one KLLSketch of durations per group for the quartiles.
+    """
+    if isinstance(group_by, str):
+        group_by = [group_by]
+
+    groups = {}
+    fields = unique_fields('duration', *(group_by + filter_fields(filters)))
+    for chunk in iter_chunks(sources, fields, chunksize):
+        chunk = chunk[filter_mask(chunk, filters)]
+        durations = chunk['duration'].values
+        for key, rows in chunk.groupby(group_by, sort = False,
+                                       observed = True).indices.items():
+            if key not in groups:
+                groups[key] = [0., KLLSketch()]
+            groups[key][0] += durations[rows].sum()
+            groups[key][1].update(durations[rows])
+
+    keys = sorted(groups)
+    index = pd.MultiIndex.from_tuples(
+        [key if isinstance(key, tuple) else (key,) for key in keys],
+        names = group_by)
+    if len(group_by) == 1:
+        index = index.get_level_values(0)
+    stats = pd.DataFrame(
+        [[len(groups[key][1]), groups[key][0] / len(groups[key][1])] +
+         list(groups[key][1].quantiles(QUARTILES)) for key in keys],
+        index = index, columns = ['count', 'mean', '25%', '50%', '75%'])
+
+    if verbose:
+        print('Trip durations (minutes) by {} (quartiles approximate):'.format(', '.join(group_by)))
+        print(stats.to_string(float_format = '{:.2f}'.format))
+
+    return stats
+
+def stream_usage_counts(sources, key, filters = [], n_bins = None,
+                        bin_width = None, boundary = None,
+                        chunksize = CHUNK_SIZE):
+    """
+    usage_counts over trip data files too large to load at once, with exact
+    counts. Returns (categorical, levels, counts) like usage_counts.
+
+    A numeric feature takes two passes over the data: one for the range of
+    the filtered values, which sets the bins, and one to count them.
+    """
+    if n_bins is not None and bin_width is not None:
+        raise Exception("Arguments 'n_bins' and 'bin_width' cannot be used simultaneously.")
+
+    fields = unique_fields(key, *filter_fields(filters))
+    categorical = None
+    value_counts = pd.Series(dtype = np.int64)
+    min_value, max_value = np.nan, np.nan
+    for chunk in iter_chunks(sources, fields, chunksize):
+        column = chunk[key][filter_mask(chunk, filters)]
+        if not len(column):
+            continue
+        if categorical is None:
+            categorical = isinstance(column.iloc[0], str)
+        if categorical:
+            value_counts = value_counts.add(column.value_counts(sort = False),
+                                            fill_value = 0)
+        else:
+            min_value = np.nanmin([min_value, column.min()])
+            max_value = np.nanmax([max_value, column.max()])
+
+    if categorical or categorical is None:
+        value_counts = value_counts.sort_index().astype(np.int64)
+        return (True, list(value_counts.index), value_counts.values)
+
+    bins = histogram_bins(min_value, max_value, n_bins, bin_width, boundary)
+    counts = np.zeros(len(bins) - 1, dtype = np.int64)
+    for chunk in iter_chunks(sources, fields, chunksize):
+        column = chunk[key][filter_mask(chunk, filters)]
+        counts += np.histogram(column.values, bins = bins)[0]
+    return (False, bins, counts)
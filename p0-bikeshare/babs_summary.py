@@ -0,0 +1,317 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+OUT_COLNAMES = ['duration', 'start_date', 'start_year', 'start_month',
+                'start_hour', 'weekday', 'start_city', 'end_city',
+                'subscription_type']
+
+CHUNK_SIZE = 100000
+
+# Column types of a trip summary once loaded. The text columns with a handful
+# of distinct values become categoricals, and the date parts small integers,
+# so they take a byte or two per trip. weekday stays a number (int8) so it
+# can still be filtered with < and > and plotted as a histogram.
+SUMMARY_DTYPES = {'duration': np.float64, 'start_date': str,
+                  'start_year': np.int16, 'start_month': np.int8,
+                  'start_hour': np.int8, 'weekday': np.int8,
+                  'start_city': 'category', 'end_city': 'category',
+                  'subscription_type': 'category', 'events': 'category'}
+
+# The city each weather station reports for, by zip code.
+WEATHER_ZIPS = {94107: 'San Francisco', 94063: 'Redwood City',
+                94301: 'Palo Alto', 94041: 'Mountain View', 95113: 'San Jose'}
+
+# Weather fields joined to the trips, by their column names in the weather
+# files once lower-cased and stripped of everything but letters (the files
+# of each year spell them differently, e.g. 'Max_Temperature_F' and
+# 'Max TemperatureF'). Temperatures are in F, humidity in %, wind speed in
+# mph, precipitation in inches and cloud cover on a scale of 0-8.
+WEATHER_COLUMNS = {'maxtemperaturef': 'max_temperature',
+                   'meantemperaturef': 'mean_temperature',
+                   'mintemperaturef': 'min_temperature',
+                   'meanhumidity': 'mean_humidity',
+                   'meanwindspeedmph': 'mean_wind_speed',
+                   'precipitationin': 'precipitation',
+                   'cloudcover': 'cloud_cover',
+                   'events': 'events'}
+
+WEATHER_FIELDS = list(WEATHER_COLUMNS.values())
+
+# Precipitation recorded as 'T', a trace of less than .01 inch, counts as
+# half that, so 'precipitation > 0' still finds those days.
+TRACE_PRECIPITATION = 0.005
+
+# Events of a day without any (blank in the weather files).
+NO_EVENTS = 'No Event'
+
+HOURS = np.array(['{:02d}'.format(h) for h in range(24)], dtype = object)
+
+def create_station_mapping(station_data):
+    """
+    Create a mapping from station IDs to cities, returning the
+    result as a dictionary. Later files take precedence over earlier ones.
+    """
+    station_map = {}
+    for data_file in station_data:
+        stations = pd.read_csv(data_file, dtype = str, keep_default_na = False,
+                               usecols = ['station_id', 'landmark'])
+        station_map.update(zip(stations['station_id'], stations['landmark']))
+    return station_map
+
+def map_terminals(terminals, station_map):
+    """
+    Cities of a column of terminal IDs. Like a dictionary lookup, raises
+    KeyError for a terminal that isn't in the station mapping.
+    """
+    cities = terminals.map(station_map)
+    missing = cities.isna()
+    if missing.any():
+        raise KeyError(terminals[missing].iloc[0])
+    return cities.values
+
+def summarise_chunk(trips, station_map):
+    """
+    Summarise a data frame of raw trip rows, read as strings, into the
+    columns of OUT_COLNAMES.
+    """
+    # Many trips start in the same minute, so each distinct start date string
+    # is parsed once, and formatted per day rather than per trip.
+    codes, dates = pd.factorize(trips['Start Date'])
+    trip_date = pd.to_datetime(dates, format = '%m/%d/%Y %H:%M').values[codes]
+    days, day_codes = np.unique(trip_date.astype('datetime64[D]'),
+                                return_inverse = True)
+    day_names = np.datetime_as_string(days, unit = 'D').astype(object)
+    hours = (trip_date - trip_date.astype('datetime64[D]')) // \
+        np.timedelta64(1, 'h')
+
+    # two different column names for subscribers depending on file
+    if 'Subscription Type' in trips.columns:
+        subscription_type = trips['Subscription Type']
+    else:
+        subscription_type = trips['Subscriber Type']
+
+    return pd.DataFrame({
+        # convert duration units from seconds to minutes
+        'duration': trips['Duration'].astype(float).values / 60,
+        'start_date': day_names[day_codes],
+        'start_year': np.array([d[:4] for d in day_names])[day_codes],
+        'start_month': np.array([d[5:7] for d in day_names])[day_codes],
+        'start_hour': HOURS[hours],
+        # 1970-01-01, day 0, was a Thursday
+        'weekday': (days.astype(np.int64) + 3)[day_codes] % 7,
+        'start_city': map_terminals(trips['Start Terminal'], station_map),
+        'end_city': map_terminals(trips['End Terminal'], station_map),
+        'subscription_type': subscription_type.values,
+        }, columns = OUT_COLNAMES)
+
+def weather_key(column):
+    """
+    Column name of a weather file, lower-cased and reduced to its letters.
+    """
+    return re.sub('[^a-z]', '', column.lower())
+
+def read_weather(weather_data):
+    """
+    Read the daily weather files given in the list weather_data into a data
+    frame of the WEATHER_FIELDS, indexed by start_city and start_date (as
+    'YYYY-MM-DD') to match the trip summary. Later files take precedence over
+    earlier ones for the same city and day.
+    """
+    frames = []
+    for data_file in weather_data:
+        weather = pd.read_csv(data_file, dtype = str, keep_default_na = False)
+        weather.columns = [weather_key(column) for column in weather.columns]
+        # the date column is 'Date' in some years and 'PDT' in others
+        weather = weather.rename(columns = {weather.columns[0]: 'date'})
+        missing = [k for k in ['zip'] + list(WEATHER_COLUMNS)
+                   if k not in weather.columns]
+        if missing:
+            raise Exception("Columns {} not found in weather file '{}'.".format(missing, data_file))
+        frames.append(weather[['date', 'zip'] + list(WEATHER_COLUMNS)])
+    weather = pd.concat(frames, ignore_index = True)
+
+    weather['start_city'] = pd.to_numeric(weather['zip']).map(WEATHER_ZIPS)
+    weather['start_date'] = pd.to_datetime(weather['date'].str.strip(),
+        format = '%m/%d/%Y').dt.strftime('%Y-%m-%d')
+    weather = weather.rename(columns = WEATHER_COLUMNS)
+
+    precipitation = weather['precipitation'].str.strip()
+    precipitation[precipitation == 'T'] = str(TRACE_PRECIPITATION)
+    weather['precipitation'] = precipitation
+    for field in WEATHER_FIELDS:
+        if field != 'events':
+            # days with a field missing have it blank
+            weather[field] = pd.to_numeric(weather[field].str.strip(),
+                                           errors = 'coerce')
+    # spelled 'rain' in some rows and 'Rain' in others
+    events = weather['events'].str.strip().str.title()
+    events[events == ''] = NO_EVENTS
+    weather['events'] = events.astype('category')
+
+    weather = weather.dropna(subset = ['start_city'])
+    weather = weather.drop_duplicates(['start_city', 'start_date'],
+                                      keep = 'last')
+    return weather.set_index(['start_city', 'start_date'])[WEATHER_FIELDS]
+
+def join_weather(data, weather):
+    """
+    Attach the weather of each trip's start city on its start date, from
+    read_weather, as new columns. Returns a new data frame; trips on days
+    without weather for their city, or missing their city or date, get
+    missing values.
+
+    The join is one hashed lookup of the weather index per distinct
+    (start_city, start_date), usually a few thousand, spread back to the
+    trips by their codes.
+    """
+    # Each column is factorized on its own, which is much faster than hashing
+    # (city, date) tuples, and the pairs of codes then as single integers.
+    city_codes, cities = pd.factorize(data['start_city'])
+    date_codes, dates = pd.factorize(data['start_date'])
+    # A missing city or date has code -1, which must not be combined into
+    # another pair's code: those trips keep code -1, for no weather.
+    pair_codes = np.where((city_codes < 0) | (date_codes < 0), -1,
+                          city_codes * len(dates) + date_codes)
+    codes, pairs = pd.factorize(pair_codes, use_na_sentinel = False)
+    found = pairs >= 0
+    n_dates = max(len(dates), 1)
+    keys = pd.MultiIndex.from_arrays([cities.take(pairs[found] // n_dates),
+                                      dates.take(pairs[found] % n_dates)])
+    rows = np.full(len(pairs), -1, dtype = np.intp)
+    rows[found] = weather.index.get_indexer(keys)
+    # reindex turns the -1 of keys without weather into missing values
+    joined = weather.reset_index(drop = True).reindex(rows)
+    joined = joined.take(codes)
+    joined.index = data.index
+    return pd.concat([data, joined], axis = 1)
+
+def summarise_data(trip_in, station_data, trip_out, chunksize = CHUNK_SIZE,
+                   weather_data = None):
+    """
+    This function takes trip and station information and outputs a new
+    data file with a condensed summary of major trip information. The
+    trip_in and station_data arguments will be lists of data files for
+    the trip and station information, respectively, while trip_out
+    specifies the location to which the summarized data will be written.
+
+    Same output, byte for byte, as the row-by-row version in the notebook,
+    but each trip file is read and transformed chunksize rows at a time with
+    pandas, so memory stays bounded however many years are summarised.
+
+    With weather_data, a list of weather files, the WEATHER_FIELDS of each
+    trip's start city and date are added after the usual columns (see
+    join_weather).
+    """
+    # generate dictionary of station - city mapping
+    station_map = create_station_mapping(station_data)
+    out_colnames = list(OUT_COLNAMES)
+    if weather_data:
+        weather = read_weather(weather_data)
+        out_colnames += WEATHER_FIELDS
+
+    with open(trip_out, 'w') as f_out:
+        # csv.DictWriter's header and line endings
+        f_out.write(','.join(out_colnames) + '\r\n')
+
+        for data_file in trip_in:
+            # Everything is read as the same strings csv.DictReader gives.
+            chunks = pd.read_csv(data_file, dtype = str,
+                                 keep_default_na = False,
+                                 chunksize = chunksize)
+            for trips in chunks:
+                summary = summarise_chunk(trips, station_map)
+                if weather_data:
+                    summary = join_weather(summary, weather)
+                summary.to_csv(f_out, header = False, index = False,
+                               lineterminator = '\r\n')
+
+def read_summary(file_in):
+    """
+    Read a trip summary written by summarise_data, with the compact column
+    types of SUMMARY_DTYPES.
+    """
+    return pd.read_csv(file_in, dtype = SUMMARY_DTYPES)
+
+def cache_path(file_in):
+    """
+    Location of the binary cache of a trip summary.
+    """
+    return file_in + '.cache.feather'
+
+def source_signature(file_in):
+    """
+    Size and modification time of a summary CSV, which change whenever it is
+    rewritten (for instance by summarise_data, from new trip data).
+    """
+    stat = os.stat(file_in)
+    return json.dumps({'file': os.path.basename(file_in),
+                       'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns},
+                      sort_keys = True)
+
+def load_summary(file_in, use_cache = True):
+    """
+    Load a trip summary CSV such as 'babs_y1_y2_summary.csv' into a data frame
+    with the compact column types of SUMMARY_DTYPES, ready for usage_stats,
+    usage_plot and question_3.
+
+    The first load parses the CSV and saves the frame next to it as a Feather
+    file (see cache_path), stamped with the size and modification time of the
+    CSV. Later loads read the Feather file instead, unless the CSV has changed
+    since, in which case it is parsed and cached again. Without pyarrow, or
+    with use_cache = False, the CSV is parsed every time.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+    except ImportError:
+        use_cache = False
+    if not use_cache:
+        return read_summary(file_in)
+
+    signature = source_signature(file_in).encode('utf-8')
+    cache_file = cache_path(file_in)
+    if os.path.exists(cache_file):
+        try:
+            with pa.memory_map(cache_file) as source:
+                metadata = pa.ipc.open_file(source).schema.metadata or {}
+            if metadata.get(b'babs_source') == signature:
+                return feather.read_table(cache_file, memory_map = True).to_pandas()
+        except (pa.ArrowInvalid, OSError):
+            pass # unreadable cache: rebuild it below
+
+    data = read_summary(file_in)
+    table = pa.Table.from_pandas(data, preserve_index = False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'babs_source'] = signature
+    table = table.replace_schema_metadata(metadata)
+    # Written to a temporary file and renamed, so an interrupted write never
+    # leaves a half-written cache behind.
+    feather.write_feather(table, cache_file + '.tmp', compression = 'uncompressed')
+    os.replace(cache_file + '.tmp', cache_file)
+    return data
+
+def test():
+    """
+    join_weather gives each trip the weather of its own city and day, and
+    missing values where there is none or its city or date is missing.
+    """
+    weather = pd.DataFrame({'max_temperature': [60., 70., 80.]},
+        index = pd.MultiIndex.from_tuples([('A', 'd1'), ('B', 'd1'),
+                                           ('B', 'd2')],
+                                          names = ['start_city', 'start_date']))
+    trips = pd.DataFrame({'start_city': ['B', np.nan, 'A', 'A', 'B', 'C'],
+                          'start_date': ['d2', 'd1', np.nan, 'd1', 'd1', 'd1']})
+    joined = join_weather(trips, weather)
+    expected = [80., np.nan, np.nan, 60., 70., np.nan]
+    assert np.array_equal(joined['max_temperature'].values, expected,
+                          equal_nan = True), joined
+    assert join_weather(trips[:0], weather).shape == (0, 3)
+    assert join_weather(trips[1:3], weather)['max_temperature'].isna().all()
+    print("join_weather: all values are as expected!")
+
+if __name__ == '__main__':
+    test()
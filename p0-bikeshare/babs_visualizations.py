@@ -1,71 +1,169 @@
+import ast
+import operator
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-def filter_data(data, condition):
+# Comparison operators accepted in filter conditions, besides 'in' and
+# 'between', which take a list and a pair of bounds.
+OPERATORS = {'>': operator.gt, '<': operator.lt, '>=': operator.ge,
+             '<=': operator.le, '==': operator.eq, '!=': operator.ne}
+
+class FilterCache(object):
     """
-    Remove elements that do not match the condition provided.
-    Takes a data list as input and returns a filtered list.
-    Conditions should be a list of strings of the following format:
-      '<field> <op> <value>'
-    where the following operations are valid: >, <, >=, <=, ==, !=
-    
-    Example: ["duration < 15", "start_city == 'San Francisco'"]
+    Filter masks and usage_counts results already computed for one data
+    frame, to reuse across calls that take cache = FilterCache(data), e.g.
+    when plotting several features under the same filters.
+
+    Nothing checks whether the frame has been edited since: after changing
+    it in any way (data.loc[...] = ..., fillna(inplace = True), ...) call
+    cache.clear(), or make a new cache.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.masks = {}
+        self.counts = {}
+
+    def clear(self):
+        self.masks.clear()
+        self.counts.clear()
+
+    def check(self, data):
+        if data is not self.data:
+            raise Exception("This cache belongs to another data frame. Make a FilterCache for each frame.")
+
+def parse_condition(condition):
+    """
+    Split a '<field> <op> <value>' condition into its parts, converting the
+    value into a number, a string without its quotes, or for 'in' and
+    'between' a list of values.
     """
 
     # Only want to split on first two spaces separating field from operator and
     # operator from value: spaces within value should be retained.
     field, op, value = condition.split(" ", 2)
-    
-    # check if field is valid
-    if field not in data.columns.values :
-        raise Exception("'{}' is not a feature of the dataframe. Did you spell something wrong?".format(field))
+
+    if op in ('in', 'between'):
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            raise Exception("Could not read the values in '{}'. Use a list such as ['a', 'b'] or 5, 15.".format(condition))
+        if not isinstance(value, (list, tuple, set)):
+            value = [value]
+        if op == 'between' and len(value) != 2:
+            raise Exception("'between' takes a lower and an upper bound, e.g. 'duration between 5, 15'.")
+        return field, op, list(value)
+
+    if op not in OPERATORS: # catch invalid operation codes
+        raise Exception("Invalid comparison operator. Only >, <, >=, <=, ==, !=, in, between allowed.")
 
     # convert value into number or strip excess quotes if string
     try:
         value = float(value)
     except:
         value = value.strip("\'\"")
+    return field, op, value
+
+def condition_mask(data, condition, cache = None):
+    """
+    Boolean NumPy array of the rows of data matching one condition. With a
+    FilterCache of data, a condition is only evaluated the first time.
+    """
+    field, op, value = parse_condition(condition)
+
+    # check if field is valid
+    if field not in data.columns.values :
+        raise Exception("'{}' is not a feature of the dataframe. Did you spell something wrong?".format(field))
+
+    if cache is not None:
+        cache.check(data)
+        if condition in cache.masks:
+            return cache.masks[condition]
 
     # get booleans for filtering
-    if op == ">":
-        matches = data[field] > value
-    elif op == "<":
-        matches = data[field] < value
-    elif op == ">=":
-        matches = data[field] >= value
-    elif op == "<=":
-        matches = data[field] <= value
-    elif op == "==":
-        matches = data[field] == value
-    elif op == "!=":
-        matches = data[field] != value
-    else: # catch invalid operation codes
-        raise Exception("Invalid comparison operator. Only >, <, >=, <=, ==, != allowed.")
-    
+    if op == 'in':
+        matches = data[field].isin(value)
+    elif op == 'between':
+        matches = data[field].between(value[0], value[1])
+    else:
+        matches = OPERATORS[op](data[field], value)
+    mask = np.asarray(matches, dtype = bool)
+    if cache is not None:
+        # shared by every caller of the cache, so it must not be changed
+        mask.setflags(write = False)
+        cache.masks[condition] = mask
+    return mask
+
+def filter_mask(data, conditions, cache = None):
+    """
+    Boolean NumPy array of the rows of data matching all of the conditions.
+    """
+    if isinstance(conditions, str):
+        conditions = [conditions]
+    mask = np.ones(data.shape[0], dtype = bool)
+    for condition in conditions:
+        mask &= condition_mask(data, condition, cache)
+    return mask
+
+def filter_data(data, condition, cache = None):
+    """
+    Remove elements that do not match the condition provided.
+    Takes a data frame as input and returns a filtered data frame.
+    Condition is a string, or a list of strings, of the following format:
+      '<field> <op> <value>'
+    where the following operations are valid: >, <, >=, <=, ==, !=, in,
+    between.
+
+    Example: ["duration < 15", "start_city == 'San Francisco'",
+              "weekday in [5, 6]", "start_hour between 7, 9"]
+
+    'between' includes both bounds. All conditions are combined into a single
+    mask, and the frame is sliced once however many conditions there are.
+    With cache, a FilterCache of data, masks are reused across calls.
+    """
+    if not condition:
+        return data
+
     # filter data and outcomes
-    data = data[matches].reset_index(drop = True)
+    data = data[filter_mask(data, condition, cache)].reset_index(drop = True)
     return data
 
-def usage_stats(data, filters = [], verbose = True):
+def usage_stats(data, filters = [], verbose = True, group_by = None,
+                cache = None):
     """
     Report number of trips and average trip duration for data points that meet
     specified filtering criteria.
+
+    With group_by, a column name or list of them (e.g. ['subscription_type',
+    'start_city']), statistics are reported for every segment at once; see
+    grouped_usage_stats. cache is an optional FilterCache of data.
+
+    data may also be the name of a trip data file (CSV or Parquet), or a list
+    of them, too large to load at once. They are then read in chunks, and the
+    quartiles are approximate; see babs_streaming.
     """
+    if isinstance(data, (str, list)):
+        # trip data files, streamed in chunks rather than loaded at once
+        from babs_streaming import stream_usage_stats
+        return stream_usage_stats(data, filters, verbose, group_by)
+
+    if group_by:
+        return grouped_usage_stats(data, group_by, filters, verbose, cache)
 
     n_data_all = data.shape[0]
 
     # Apply filters to data
-    for condition in filters:
-        data = filter_data(data, condition)
+    data = filter_data(data, filters, cache)
 
     # Compute number of data points that met the filter criteria.
     n_data = data.shape[0]
 
     # Compute statistics for trip durations.
     duration_mean = data['duration'].mean()
-    duration_qtiles = data['duration'].quantile([.25, .5, .75]).as_matrix()
+    duration_qtiles = data['duration'].quantile([.25, .5, .75]).values
     
     # Report computed statistics if verbosity is set to True (default).
     if verbose:
@@ -83,7 +181,40 @@ def usage_stats(data, filters = [], verbose = True):
     return duration_qtiles
 
 
-def usage_plot(data, key = '', filters = [], **kwargs):
+def grouped_usage_stats(data, group_by, filters = [], verbose = True,
+                        cache = None):
+    """
+    Number of trips, average trip duration and duration quartiles for every
+    combination of values of the group_by columns, among the data points that
+    meet the filtering criteria. Computed in a single groupby pass; returns a
+    data frame indexed by the group_by columns, with columns count, mean, 25%,
+    50% and 75%.
+    """
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    for key in group_by:
+        if key not in data.columns.values :
+            raise Exception("'{}' is not a feature of the dataframe. Did you spell something wrong?".format(key))
+
+    # Apply filters to data
+    data = filter_data(data, filters, cache)
+
+    groups = data.groupby(group_by, sort = True, observed = True)['duration']
+    stats = groups.agg(['count', 'mean'])
+    # (reindexed, as no rows leave no quantile columns to unstack)
+    qtiles = groups.quantile([.25, .5, .75]).unstack().reindex(
+        columns = [.25, .5, .75])
+    qtiles.columns = ['25%', '50%', '75%']
+    stats = stats.join(qtiles)
+
+    if verbose:
+        print('Trip durations (minutes) by {}:'.format(', '.join(group_by)))
+        print(stats.to_string(float_format = '{:.2f}'.format))
+
+    return stats
+
+
+def usage_plot(data, key = '', filters = [], cache = None, **kwargs):
     """
     Plot number of trips, given a feature of interest and any number of filters
     (including no filters). Function takes a number of optional arguments for
@@ -94,74 +225,132 @@ def usage_plot(data, key = '', filters = [], **kwargs):
       - boundary: specifies where one of the bar edges will be placed; other
         bar edges will be placed around that value (may result in an additional
         bar being plotted). Can be used with "n_bins" and "bin_width".
+    cache is an optional FilterCache of data; see usage_counts.
+
+    data may also be the name of a trip data file (CSV or Parquet), or a list
+    of them, too large to load at once; see babs_streaming.
     """
     
     # Check that the key exists
     if not key:
         raise Exception("No key has been provided. Make sure you provide a variable on which to plot the data.")
-    if key not in data.columns.values :
-        raise Exception("'{}' is not a feature of the dataframe. Did you spell something wrong?".format(key))
 
-    # Apply filters to data
-    for condition in filters:
-        data = filter_data(data, condition)
+    binning = {k: kwargs[k] for k in ('n_bins', 'bin_width', 'boundary')
+               if k in kwargs}
+    if isinstance(data, (str, list)):
+        # trip data files, streamed in chunks rather than loaded at once
+        from babs_streaming import stream_usage_counts
+        categorical, levels, counts = stream_usage_counts(data, key, filters,
+                                                          **binning)
+    else:
+        if key not in data.columns.values :
+            raise Exception("'{}' is not a feature of the dataframe. Did you spell something wrong?".format(key))
+        categorical, levels, counts = usage_counts(data, key, filters,
+                                                   cache = cache, **binning)
 
     # Create plotting figure
     plt.figure(figsize=(8,6))
 
-    if isinstance(data[key][0] , str): # Categorical features
-        # For strings, collect unique strings and then count number of
-        # outcomes for survival and non-survival.
-        
-        # Summarize dataframe to get counts in each group
-        data['count'] = 1
-        data = data.groupby(key, as_index = False).count()
-        
-        levels = data[key].unique()
+    if categorical: # Categorical features
         n_levels = len(levels)
         bar_width = 0.8
-        
+
         for i in range(n_levels):
-            trips_bar = plt.bar(i - bar_width/2, data.loc[i]['count'], width = bar_width)
-        
+            trips_bar = plt.bar(i - bar_width/2, counts[i], width = bar_width)
+
         # add labels to ticks for each group of bars.
         plt.xticks(range(n_levels), levels)
-        
+
+    else: # Numeric features
+        # Draw the precomputed counts as a histogram: one point per bin,
+        # weighted by its count.
+        plt.hist(levels[:-1], bins = levels, weights = counts)
+
+    # Common attributes for plot formatting
+    key_name = ' '.join([x.capitalize() for x in key.split('_')])
+    plt.xlabel(key_name)
+    plt.ylabel("Number of Trips")
+    plt.title("Number of Trips by {:s}".format(key_name))
+    plt.show()
+
+
+def usage_counts(data, key, filters = [], n_bins = None, bin_width = None,
+                 boundary = None, cache = None):
+    """
+    Number of trips behind usage_plot, given a feature of interest, filters
+    and binning options (see usage_plot). Returns (categorical, levels,
+    counts), where levels are the sorted distinct values of a categorical
+    feature, or the bin edges of a numeric one.
+
+    With cache, a FilterCache of data, counts are kept by key, filters and
+    binning, so re-plotting the same counts costs nothing. The arrays
+    returned are read-only, as they may be shared through the cache. The
+    data frame is never modified.
+    """
+    if n_bins is not None and bin_width is not None:
+        raise Exception("Arguments 'n_bins' and 'bin_width' cannot be used simultaneously.")
+    if isinstance(filters, str):
+        filters = [filters]
+
+    cache_key = (key, tuple(filters), n_bins, bin_width, boundary)
+    if cache is not None:
+        cache.check(data)
+        if cache_key in cache.counts:
+            categorical, levels, counts = cache.counts[cache_key]
+            # (a list of levels is copied, as it can't be made read-only)
+            return categorical, levels[:] if categorical else levels, counts
+
+    column = data[key]
+    if filters:
+        column = column[filter_mask(data, filters, cache)]
+
+    if len(column) and isinstance(column.iloc[0], str): # Categorical features
+        # For strings, count the trips for each distinct value.
+        value_counts = column.value_counts(sort = False).sort_index()
+        # (a categorical column also counts the categories filtered out)
+        value_counts = value_counts[value_counts > 0]
+        categorical = True
+        levels, counts = list(value_counts.index), value_counts.values.copy()
+
     else: # Numeric features
         # For numbers, divide the range of data into bins and count
-        # number of outcomes for survival and non-survival in each bin.
-        
+        # number of trips in each bin.
+
         # Set up bin boundaries for plotting
-        if kwargs and 'n_bins' in kwargs and 'bin_width' in kwargs:
-            raise Exception("Arguments 'n_bins' and 'bin_width' cannot be used simultaneously.")
+        bins = histogram_bins(column.min(), column.max(), n_bins, bin_width,
+                              boundary)
+        categorical = False
+        counts, levels = np.histogram(column.values, bins = bins)
+        levels.setflags(write = False)
 
-        min_value = data[key].min()
-        max_value = data[key].max()
-        value_range = max_value - min_value
+    counts.setflags(write = False)
+    if cache is not None:
+        cache.counts[cache_key] = (categorical, levels, counts)
+        if categorical:
+            levels = levels[:]
+    return categorical, levels, counts
+
+
+def histogram_bins(min_value, max_value, n_bins = None, bin_width = None,
+                   boundary = None):
+    """
+    Bin edges for a numeric feature ranging from min_value to max_value,
+    given the binning options of usage_plot.
+    """
+    value_range = max_value - min_value
+    if n_bins is not None:
+        n_bins = int(n_bins)
+        bin_width = float(value_range) / n_bins
+    elif bin_width is not None:
+        n_bins = int(np.ceil(float(value_range) / bin_width))
+    else:
         n_bins = 10
         bin_width = float(value_range) / n_bins
 
-        if kwargs and 'n_bins' in kwargs:
-            n_bins = int(kwargs['n_bins'])
-            bin_width = float(value_range) / n_bins
-        elif kwargs and 'bin_width' in kwargs:
-            bin_width = kwargs['bin_width']
-            n_bins = int(np.ceil(float(value_range) / bin_width))
-        
-        if kwargs and 'boundary' in kwargs:
-            bound_factor = np.floor(( min_value - kwargs['boundary'] ) / bin_width)
-            min_value = kwargs['boundary'] + bound_factor * bin_width
-            if min_value + n_bins * bin_width <= max_value:
-                n_bins += 1
-
-        bins = [i*bin_width + min_value for i in range(n_bins+1)]
-        
-        # plot the data
-        plt.hist(data[key], bins = bins)
+    if boundary is not None:
+        bound_factor = np.floor(( min_value - boundary ) / bin_width)
+        min_value = boundary + bound_factor * bin_width
+        if min_value + n_bins * bin_width <= max_value:
+            n_bins += 1
 
-    # Common attributes for plot formatting
-    key_name = ' '.join([x.capitalize() for x in key.split('_')])
-    plt.xlabel(key_name)
-    plt.ylabel("Number of Trips")
-    plt.title("Number of Trips by {:s}".format(key_name))
-    plt.show()
\ No newline at end of file
+    return np.arange(n_bins + 1) * bin_width + min_value
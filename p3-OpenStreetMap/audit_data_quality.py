@@ -1,31 +1,38 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import xml.etree.cElementTree as ET
 import pprint
 import re
 
+from audit_engine import register_auditor, run_audits
+
 
 lower = re.compile(r'^([a-z]|_)*$')
 lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
 problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
 
-def audit_key_types(file_in):
+@register_auditor
+class KeyTypeAuditor(object):
+    '''Count every tag key and collect the distinct values seen for it.'''
+    name = 'key_types'
+    keys = None
 
-    data = {}
+    def __init__(self):
+        self.data = {}
 
-    for _, element in ET.iterparse(file_in):
+    def audit_tag(self, k, v):
+        if k not in self.data:
+            self.data[k] = {'count': 1, 'vals': set([v])}
+        else:
+            self.data[k]['count'] += 1
+            self.data[k]['vals'].add(v)
 
-        if element.tag == "node" or element.tag == "way":
-            for tag in element.findall('tag'):
-                k = tag.get('k')
+    def report(self):
+        return self.data
 
-                if k not in data:
-                    data[k] = {'count': 1, 'vals': set([tag.get('v')])}
-                else:
-                    data[k]['count'] += 1
-                    data[k]['vals'].add(tag.get('v'))
-    return data
+
+def audit_key_types(file_in):
+    return run_audits(file_in, [KeyTypeAuditor()])['key_types']
 
 
 def display_address_counts(data):
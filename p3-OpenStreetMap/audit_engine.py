@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Run any number of audits over an OSM file in a single streaming pass.
+
+An auditor is an object with:
+    name            key of its section in the combined report
+    keys            tag keys it wants to see, or None for every key
+    audit_tag(k, v) called for each matching <tag> of every node and way
+    report()        returns its findings once the pass is done
+
+Auditors register themselves with the @register_auditor class decorator in
+the module that owns the corresponding cleaning code.
+'''
+from collections import defaultdict
+import pprint
+
+from osm_reader import iter_elements
+
+AUDITORS = {}
+
+
+def register_auditor(cls):
+    AUDITORS[cls.name] = cls
+    return cls
+
+
+def default_auditors():
+    '''Return a fresh instance of every auditor shipped with the project.'''
+    # Imported here for their @register_auditor side effect; they import
+    # this module themselves so this cannot happen at the top of the file.
+    import audit_data_quality
+    import audit_streetnames
+    import format_hours
+    import format_phones
+    return [cls() for cls in AUDITORS.values()]
+
+
+def run_audits(file_in, auditors, tags=('node', 'way')):
+    '''Feed every tag of file_in to the auditors, return the combined report.'''
+    by_key = defaultdict(list)
+    any_key = []
+    for auditor in auditors:
+        if auditor.keys is None:
+            any_key.append(auditor)
+        else:
+            for k in auditor.keys:
+                by_key[k].append(auditor)
+
+    for element in iter_elements(file_in, tags):
+        for tag in element.findall('tag'):
+            k = tag.get('k')
+            v = tag.get('v')
+            for auditor in any_key:
+                auditor.audit_tag(k, v)
+            for auditor in by_key.get(k, ()):
+                auditor.audit_tag(k, v)
+
+    return {auditor.name: auditor.report() for auditor in auditors}
+
+
+def audit_all(file_in):
+    return run_audits(file_in, default_auditors())
+
+
+if __name__ == '__main__':
+    # Run as a script this module is __main__, while the auditors register
+    # with the importable audit_engine, so go through that one.
+    import audit_engine
+    pprint.pprint(audit_engine.audit_all('toronto-sample.osm'))
@@ -11,11 +11,12 @@ Your task in this exercise has two steps:
     The function takes a string with street name as an argument and should return the fixed name
     We have provided a simple test so that you see what exactly is expected
 """
-import xml.etree.ElementTree as ET
 from collections import defaultdict
 import re
 import pprint
 
+from audit_engine import register_auditor, run_audits
+
 OSMFILE = "toronto_canada.osm"
 street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
 
@@ -56,49 +57,137 @@ STREET_MAPPING = {"St": "Street",
                   }
 
 
-def audit_street_type(street_types, street_name):
-    m = street_type_re.search(street_name)
+class StreetNameResolver(object):
+    '''
+    Street name auditing and cleaning with the lookup tables built once.
+    Cardinal suffixes, their abbreviations, the street type mapping and the
+    expected types are held in dicts and sets, and a name is resolved by
+    peeling its trailing tokens off in a loop rather than by recursion.
+    Results are the same as the original recursive functions, including the
+    TypeError raised for names that are nothing but cardinals.
+    '''
+
+    def __init__(self, expected=expected, cardinals=CARDINALS,
+                 card_map=CARD_MAP, street_mapping=STREET_MAPPING):
+        # ending -> (full cardinal, whether the ending is an abbreviation)
+        self.cardinals = {c: (c, False) for c in cardinals}
+        for abbrev, full in card_map.items():
+            self.cardinals.setdefault(abbrev, (full, True))
+        self.street_mapping = dict(street_mapping)
+        self.expected = frozenset(expected)
+
+    def parse(self, name):
+        suffix = ''
+        while True:
+            ending = last_token(name)
+            if ending is None:
+                if suffix:
+                    raise TypeError("no street name before '{}'".format(
+                        suffix.strip()))
+                return None
+            cardinal = self.cardinals.get(ending)
+            if cardinal:
+                suffix = ' ' + cardinal[0] + suffix
+                name = name[:-(len(ending) + 1)]
+                continue
+            mapped = self.street_mapping.get(ending)
+            if mapped is not None:
+                return name[:-(len(ending) + 1)] + ' ' + mapped + suffix
+            return name + suffix
+
+    def audit(self, street_types, street_name):
+        while True:
+            street_type = last_token(street_name)
+            if street_type is None:
+                return
+            cardinal = self.cardinals.get(street_type)
+            if cardinal:
+                full, is_abbrev = cardinal
+                if is_abbrev:
+                    street_name = street_name[:-len(street_type)] + full
+                else:
+                    street_name = street_name[:-(len(street_type) + 1)]
+                continue
+            if street_type not in self.expected:
+                street_types[street_type].add(street_name)
+            return
+
+    def parse_many(self, names):
+        '''
+        Clean an iterable of street names, parsing each distinct name once.
+        Names parse_street_name would raise on come back as None.
+        '''
+        seen = {}
+        result = []
+        for name in names:
+            try:
+                result.append(seen[name])
+            except KeyError:
+                try:
+                    parsed = self.parse(name)
+                except TypeError:
+                    parsed = None
+                seen[name] = parsed
+                result.append(parsed)
+        return result
+
+    def audit_many(self, names):
+        '''Audit an iterable of street names, each distinct name once.'''
+        street_types = defaultdict(set)
+        for name in set(names):
+            self.audit(street_types, name)
+        return street_types
+
+
+resolver = StreetNameResolver()
+
+
+def last_token(name):
+    '''
+    What street_type_re.search(name) would match, or None. When the last
+    token starts with a word character and nothing trails it, that is simply
+    the last whitespace separated token, found without the regex.
+    '''
+    if name and not name[-1].isspace():
+        token = name.rsplit(None, 1)[-1]
+        if token[0].isalnum() or token[0] == '_':
+            return token
+    m = street_type_re.search(name)
     if m:
-        street_type = m.group()
-        if street_type in CARDINALS:
-            audit_street_type(street_types, street_name[
-                              :-(len(street_type) + 1)])
-        elif street_type in CARD_MAP.keys():
-            audit_street_type(street_types, street_name[
-                              :-len(street_type)] + CARD_MAP[street_type])
-        elif street_type not in expected:
-            street_types[street_type].add(street_name)
+        return m.group()
+    return None
+
+
+def audit_street_type(street_types, street_name):
+    resolver.audit(street_types, street_name)
 
 
 def is_street_name(elem):
     return (elem.attrib['k'] == "addr:street")
 
 
-def audit(osmfile):
-    # osm_file = open(osmfile, "r")
-    street_types = defaultdict(set)
+@register_auditor
+class StreetTypeAuditor(object):
+    '''Group street names by any street type not in the expected list.'''
+    name = 'street_types'
+    keys = ('addr:street',)
 
-    for event, elem in ET.iterparse(osmfile, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_street_name(tag):
-                    audit_street_type(street_types, tag.attrib['v'])
-        elem.clear()
-    return street_types
+    def __init__(self):
+        self.street_types = defaultdict(set)
+
+    def audit_tag(self, k, v):
+        audit_street_type(self.street_types, v)
+
+    def report(self):
+        return self.street_types
+
+
+def audit(osmfile):
+    return run_audits(osmfile, [StreetTypeAuditor()])['street_types']
 
 
 def parse_street_name(name):
-    m = street_type_re.search(name)
-    if m:
-        ending = m.group()
-        if ending in CARDINALS:
-            return parse_street_name(name[:-(len(ending) + 1)]) + ' ' + ending
-        elif ending in CARD_MAP:
-            return parse_street_name(name[:-(len(ending) + 1)]) + ' ' + CARD_MAP[ending]
-        elif ending in STREET_MAPPING:
-            return name[:-(len(ending) + 1)] + ' ' + STREET_MAPPING[ending]
-        else:
-            return name
+    return resolver.parse(name)
 
 
 def test():
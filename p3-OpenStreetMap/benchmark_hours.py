@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Micro-benchmark for the opening hours normalizer in format_hours.
+
+Times parse_opening_hours against the previous implementation (kept below:
+it compiled its patterns on every call, rebuilt the string once per match
+and looked days up with list.index) over the module's test_data and a large
+synthetic corpus, after checking that both produce the same output for every
+string.
+
+Usage: python benchmark_hours.py [corpus_size]
+'''
+import random
+import re
+import sys
+import timeit
+
+from collections import defaultdict
+
+from format_hours import (test_data, days_week, days_map, split_entry,
+                          clean_sched_string, abbrev_days,
+                          parse_opening_hours)
+
+
+def legacy_clean_sched_string(input_str):
+    output = input_str
+    pattern = re.compile(r'[\d]+(, )[\w]+')
+    iterator = pattern.finditer(output)
+    for match in iterator:
+        output = "{}; {}".format(output[:match.span()[0] + 2],
+                                 output[match.span()[1] - 2:])
+
+    pattern = re.compile(r'[ ,-]\d{1}:')
+    iterator = pattern.finditer(output)
+    i = 0
+    for match in iterator:
+        i = i + 1
+        output = "{}0{}".format(output[:match.span()[0] + i],
+                                output[match.span()[0] + i:])
+
+    output = output.replace(" : ", " ")
+    output = output.replace(" | ", "; ")
+    return output
+
+
+def legacy_abbrev_days(input_str):
+    pattern = re.compile(r'\b(' + '|'.join(days_map.keys()) + r')\b')
+    result = pattern.sub(lambda x: days_map[x.group()], input_str)
+    return result
+
+
+def legacy_build_hours_dict(input_str):
+    daily_schedule = {}
+
+    if input_str == '24/7':
+        for day in days_week[:7]:
+            daily_schedule[day] = '00:00-24:00'
+
+        return daily_schedule
+
+    entries = input_str.split('; ')
+
+    for entry in entries:
+        days, hours = split_entry(entry)
+        days = legacy_parse_days(days)
+
+        if hours == 'off':
+            continue
+
+        for day in days:
+            daily_schedule[day] = hours
+
+    return daily_schedule
+
+
+def legacy_parse_days(input_str):
+    list_days = []
+    if ',' in input_str:
+        parts = input_str.split(',')
+    else:
+        parts = [input_str]
+
+    for part in parts:
+        if '-' in part:
+            dayrange = part.split('-')
+            begin = days_week.index(dayrange[0])
+            end = days_week.index(dayrange[1])
+            if begin <= end:
+                list_days = list_days + days_week[begin:end + 1]
+            elif begin > end:
+                list_days = list_days + \
+                    days_week[begin:7] + days_week[:end + 1]
+
+        else:
+            list_days.append(part)
+
+    return list_days
+
+
+def legacy_format_days_list(input_list):
+    if len(input_list) == 1:
+        return input_list[0]
+
+    num_list = [days_week.index(x) for x in input_list]
+    diffs = [y - x for x, y in zip(num_list[0:-1], num_list[1:])]
+
+    output = input_list[0]
+    for day, diff, i in zip(input_list[1:], diffs, range(len(diffs))):
+        if diff == 1:
+            if i == len(diffs) - 1 or diffs[i + 1] != 1:
+                output = output + '-' + day
+
+        if diff > 1:
+            output = output + ',' + day
+    return output
+
+
+def legacy_format_schedule(input_dict):
+    groupby_hours = defaultdict(list)
+
+    for key, value in sorted(input_dict.items()):
+        groupby_hours[value].append(key)
+
+    for k in groupby_hours:
+        groupby_hours[k] = sorted(
+            groupby_hours[k], key=lambda x: days_week.index(x))
+
+        groupby_hours[k] = legacy_format_days_list(groupby_hours[k])
+
+    sched_list = []
+    for k, v in groupby_hours.items():
+        sched_list.append('{} {}'.format(v, k))
+
+    sched_list = sorted(sched_list, key=lambda x: days_week.index(x[:2]))
+
+    return "; ".join(sched_list)
+
+
+def legacy_parse_opening_hours(input_str):
+    try:
+        cleaned = legacy_clean_sched_string(input_str)
+        abbrev = legacy_abbrev_days(cleaned)
+        hours_dict = legacy_build_hours_dict(abbrev)
+        sched = legacy_format_schedule(hours_dict)
+        return sched
+    except:
+        return input_str
+
+
+def synthetic_corpus(size, seed=0):
+    '''Opening hours strings in the shapes, good and bad, seen in the data.'''
+    rnd = random.Random(seed)
+    days = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su', 'Monday', 'Friday',
+            'Minday', 'PH', 'Tue', 'Sat']
+    separators = ['; ', ', ', ' | ', ' : ', ';']
+
+    def hour():
+        return '{}:{:02d}'.format(rnd.choice(['', '0', '1', '2']) +
+                                  str(rnd.randint(0, 9)),
+                                  rnd.choice([0, 15, 30, 45]))
+
+    def entry():
+        span = rnd.choice(days)
+        if rnd.random() < 0.6:
+            span += rnd.choice(['-', ',']) + rnd.choice(days)
+        if rnd.random() < 0.1:
+            return span + ' off'
+        times = '-'.join([hour(), hour()])
+        if rnd.random() < 0.2:
+            times += ',' + '-'.join([hour(), hour()])
+        return span + ' ' + times
+
+    corpus = []
+    for _ in range(size):
+        if rnd.random() < 0.2:
+            corpus.append(rnd.choice(test_data))
+        else:
+            n = rnd.randint(1, 4)
+            corpus.append(rnd.choice(separators).join(entry()
+                                                      for _ in range(n)))
+    return corpus
+
+
+def check(corpus):
+    for s in corpus:
+        assert parse_opening_hours(s) == legacy_parse_opening_hours(s), s
+
+
+def time_it(func, corpus, repeat=3):
+    return min(timeit.repeat(lambda: [func(s) for s in corpus],
+                             number=1, repeat=repeat))
+
+
+def test(corpus_size=100000):
+    corpora = [('test_data x 1000', test_data * 1000),
+               ('synthetic', synthetic_corpus(corpus_size))]
+    stages = [('clean + abbrev',
+               lambda s: legacy_abbrev_days(legacy_clean_sched_string(s)),
+               lambda s: abbrev_days(clean_sched_string(s))),
+              ('full parse', legacy_parse_opening_hours, parse_opening_hours)]
+    for name, corpus in corpora:
+        check(corpus)
+        print("{}: {:d} strings".format(name, len(corpus)))
+        for stage, legacy_func, current_func in stages:
+            legacy = time_it(legacy_func, corpus)
+            current = time_it(current_func, corpus)
+            print("  {:>14}: legacy {:.3f}s, current {:.3f}s, {:.2f}x".format(
+                stage, legacy, current, legacy / current))
+
+
+if __name__ == '__main__':
+    test(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
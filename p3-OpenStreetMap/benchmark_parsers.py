@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Compare the osm_reader parser backends on the same file.
+
+For each backend that can be imported, stream the file's elements, touching
+their tags the way the audits do, and report elements/sec. This is done
+once for every node, way and relation, and once for ways only. In the
+ways-only run every backend still sees the skipped nodes in Python: etree and
+lxml hand them over so they can be cleared, and expat runs its Python
+callbacks for every element, though it only builds Element objects for the
+ways. The counts are checked to agree across backends.
+
+Usage: python benchmark_parsers.py [file]
+'''
+import sys
+import time
+
+from osm_reader import BACKENDS, TOP_LEVEL, iter_elements
+
+
+def run(file_in, backend, tags):
+    start = time.time()
+    n_elements = 0
+    n_tags = 0
+    for element in iter_elements(file_in, tags, backend):
+        n_elements += 1
+        n_tags += len(element.findall('tag'))
+    return n_elements, n_tags, time.time() - start
+
+
+def test(file_in='toronto-sample.osm'):
+    for tags in [TOP_LEVEL, ('way',)]:
+        print("Elements: {}".format(', '.join(tags)))
+        results = {}
+        for backend in BACKENDS:
+            try:
+                results[backend] = run(file_in, backend, tags)
+            except ImportError as e:
+                print("{:>8}: not available ({})".format(backend, e))
+                continue
+            n_elements, n_tags, elapsed = results[backend]
+            print("{:>8}: {:d} elements, {:d} tags in {:.2f}s "
+                  "({:.0f} elements/sec)".format(backend, n_elements, n_tags,
+                                                 elapsed,
+                                                 n_elements / elapsed))
+
+        counts = set((n, n_tags) for n, n_tags, _ in results.values())
+        assert len(counts) == 1, "backends disagree: {}".format(results)
+
+
+if __name__ == '__main__':
+    test(sys.argv[1] if len(sys.argv) > 1 else 'toronto-sample.osm')
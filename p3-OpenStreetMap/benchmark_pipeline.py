@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Scaling benchmark for the p3-OpenStreetMap pipeline, on synthetic extracts.
+
+For each scale, a synthetic file is written with synthetic_osm and each
+stage is timed on it:
+    audit_key_types, audit (street types), process_map,
+    create_reduced_dataset
+Each result is printed and appended as a JSON line to benchmark_results.jsonl,
+along with the date and Python version, so runs can be compared over time.
+
+Usage: python benchmark_pipeline.py [n_nodes ...]
+'''
+import json
+import os
+import platform
+import sys
+import time
+
+from audit_data_quality import audit_key_types
+from audit_streetnames import audit
+from create_reduced_dataset import create_reduced_dataset
+from last_store_in_DB import process_map
+from synthetic_osm import write_synthetic_osm
+
+SCALES = [10000, 100000, 1000000]
+
+RESULTS_FILE = 'benchmark_results.jsonl'
+
+STAGES = [('audit_key_types', audit_key_types),
+          ('audit', audit),
+          ('process_map', process_map),
+          ('create_reduced_dataset',
+           lambda file_in: create_reduced_dataset(
+               file_in, out_file=file_in + '.sample.osm', k=10))]
+
+
+def outputs(file_in):
+    return [file_in + '.json', file_in + '.sample.osm']
+
+
+def benchmark(n_nodes, file_in='synthetic_pipeline.osm'):
+    n_elements = write_synthetic_osm(file_in, n_nodes)
+    size_mb = os.path.getsize(file_in) / 1024. / 1024
+    results = []
+    try:
+        for stage, func in STAGES:
+            start = time.time()
+            func(file_in)
+            elapsed = time.time() - start
+            results.append({'stage': stage,
+                            'n_nodes': n_nodes,
+                            'n_elements': n_elements,
+                            'size_mb': size_mb,
+                            'seconds': elapsed,
+                            'elements_per_sec': n_elements / elapsed})
+            print("{:>9d} nodes, {:7.1f} MB {:>24}: {:8.2f}s "
+                  "({:.0f} elements/sec)".format(n_nodes, size_mb, stage,
+                                                 elapsed,
+                                                 n_elements / elapsed))
+    finally:
+        for name in [file_in] + outputs(file_in):
+            if os.path.exists(name):
+                os.remove(name)
+    return results
+
+
+def test(scales=SCALES, results_file=RESULTS_FILE):
+    run = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'python': platform.python_version()}
+    with open(results_file, 'a') as f:
+        for n_nodes in scales:
+            for result in benchmark(n_nodes):
+                result.update(run)
+                f.write(json.dumps(result, sort_keys=True) + "\n")
+
+
+if __name__ == '__main__':
+    test([int(n) for n in sys.argv[1:]] or SCALES)
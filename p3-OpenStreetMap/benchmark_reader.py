@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Memory benchmark for osm_reader.iter_elements.
+
+Writes a synthetic OSM file of the requested size (1 GB by default), streams
+it through the reader and samples resident memory along the way. The bound
+holds if memory after the whole file is no larger than after the first tenth
+of it, give or take a few MB of allocator noise.
+
+Usage: python benchmark_reader.py [size_mb] [file]
+'''
+import os
+import resource
+import sys
+import time
+
+from osm_reader import iter_elements
+from synthetic_osm import write_synthetic_osm
+
+TOLERANCE_MB = 16
+
+
+def current_rss_mb():
+    '''Resident set size of this process, in MB.'''
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024. / 1024
+    except (IOError, OSError):
+        # ru_maxrss is the peak, in kB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024. / (1024 if sys.platform == 'darwin' else 1)
+
+
+def benchmark(file_in, n_elements):
+    checkpoint = n_elements // 10
+    start_rss = current_rss_mb()
+    early_rss = peak_rss = start_rss
+    start = time.time()
+
+    for i, element in enumerate(iter_elements(file_in)):
+        if i % 10000 == 0:
+            peak_rss = max(peak_rss, current_rss_mb())
+        if i == checkpoint:
+            early_rss = peak_rss
+
+    elapsed = time.time() - start
+    print("{:d} elements in {:.1f}s ({:.0f} elements/sec)".format(
+        n_elements, elapsed, n_elements / elapsed))
+    print("RSS at start: {:.1f} MB".format(start_rss))
+    print("Peak RSS after 10% of file: {:.1f} MB".format(early_rss))
+    print("Peak RSS after 100% of file: {:.1f} MB".format(peak_rss))
+    return early_rss, peak_rss
+
+
+def test(size_mb=1024, file_in='synthetic_benchmark.osm'):
+    print("Writing {} MB synthetic file to {}".format(size_mb, file_in))
+    n_elements = write_synthetic_osm(file_in, size_mb=size_mb)
+    try:
+        early_rss, peak_rss = benchmark(file_in, n_elements)
+    finally:
+        os.remove(file_in)
+    assert peak_rss <= early_rss + TOLERANCE_MB, \
+        "memory grew by {:.1f} MB".format(peak_rss - early_rss)
+    print("Memory bound holds.")
+
+
+if __name__ == '__main__':
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    file_in = sys.argv[2] if len(sys.argv) > 2 else 'synthetic_benchmark.osm'
+    test(size_mb, file_in)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Compare the json_output serializers and compression options.
+
+The file is shaped once. The shaped documents are then written with each
+serializer that can be imported, uncompressed and through each compressor.
+For each run we report MB/s of JSON produced and the size on disk. The
+documents are read back and checked to match.
+
+The old path, codecs.open with a json.dumps per element, is timed too, as
+the baseline.
+
+Usage: python benchmark_serializers.py [file]
+'''
+import codecs
+import gzip
+import json
+import os
+import sys
+import time
+
+from json_output import SERIALIZERS, COMPRESSION, JsonLinesWriter, \
+    make_encoder
+from last_store_in_DB import shape_element
+from osm_reader import iter_elements
+
+
+def read_back(file_out, compression):
+    if compression == 'zstd':
+        import zstandard
+        with open(file_out, 'rb') as f:
+            data = zstandard.ZstdDecompressor().stream_reader(f).read()
+    elif compression == 'gzip':
+        with gzip.open(file_out, 'rb') as f:
+            data = f.read()
+    else:
+        with open(file_out, 'rb') as f:
+            data = f.read()
+    return [json.loads(line) for line in data.splitlines()]
+
+
+def baseline(docs, file_out):
+    start = time.time()
+    with codecs.open(file_out, "w") as fo:
+        for el in docs:
+            fo.write(json.dumps(el) + "\n")
+    return time.time() - start
+
+
+def run(docs, file_out, serializer, compression):
+    start = time.time()
+    with JsonLinesWriter(file_out, serializer=serializer,
+                         compression=compression) as writer:
+        writer.write_all(docs)
+    return time.time() - start
+
+
+def test(file_in='toronto-sample.osm'):
+    docs = [doc for doc in map(shape_element, iter_elements(file_in)) if doc]
+    file_out = file_in + '.benchmark.json'
+
+    elapsed = baseline(docs, file_out)
+    size_mb = os.path.getsize(file_out) / 1024. / 1024
+    print("{:>8} {:>5}: {:7.1f} MB/s, {:6.1f} MB on disk".format(
+        'codecs', '-', size_mb / elapsed, size_mb))
+
+    for serializer in SERIALIZERS:
+        for compression in COMPRESSION:
+            try:
+                elapsed = run(docs, file_out, serializer, compression)
+            except ImportError as e:
+                print("{:>8} {:>5}: not available ({})".format(
+                    serializer, compression or '-', e))
+                continue
+            assert read_back(file_out, compression) == docs
+            # MB/s of JSON produced, so compressed runs compare fairly
+            encode = make_encoder(serializer)
+            json_mb = sum(len(encode(doc)) for doc in docs) / 1024. / 1024
+            print("{:>8} {:>5}: {:7.1f} MB/s, {:6.1f} MB on disk".format(
+                serializer, compression or '-', json_mb / elapsed,
+                os.path.getsize(file_out) / 1024. / 1024))
+    os.remove(file_out)
+
+
+if __name__ == '__main__':
+    test(sys.argv[1] if len(sys.argv) > 1 else 'toronto-sample.osm')
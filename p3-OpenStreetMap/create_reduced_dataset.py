@@ -1,29 +1,114 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import xml.etree.ElementTree as ET  # Use cElementTree or lxml if too slow
+import random
 
+# Set OSM_PARSER_BACKEND=lxml or expat if too slow
+from osm_reader import iter_elements, tostring
 
-def create_reduced_dataset(in_file, out_file="sample.osm", k=10):
+
+def in_bbox(element, bbox):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return min_lat <= float(element.get('lat')) <= max_lat and \
+        min_lon <= float(element.get('lon')) <= max_lon
+
+
+def node_refs(element):
+    return [int(nd.get('ref')) for nd in element.findall('nd')]
+
+
+def select_elements(in_file, mode='every', k=10, size=None, bbox=None,
+                    closed=False, seed=None):
     '''
-    Take as input an OSM file, return back a sized-down version of the file
-    taking only every kth top level element.
+    First pass of create_reduced_dataset. Returns the positions of the
+    selected top level elements, and the ids of any extra nodes needed to
+    close the selected ways.
+    '''
+    selected = set()
+    refs = {}   # position of a selected way -> the node ids it references
 
-    Source: Udacity Data Analysis Nanodegree, Project 3, Project Details
+    if mode == 'every':
+        if not closed:
+            # Nothing to look up; positions are known without reading.
+            return None, set()
+        for i, element in enumerate(iter_elements(in_file)):
+            if i % k == 0:
+                selected.add(i)
+                if element.tag == 'way':
+                    refs[i] = node_refs(element)
+
+    elif mode == 'reservoir':
+        # Algorithm R: every element ends up in the sample with equal
+        # probability, in one pass and O(size) memory.
+        rnd = random.Random(seed)
+        reservoir = []
+        for i, element in enumerate(iter_elements(in_file)):
+            if i < size:
+                j = i
+            else:
+                j = rnd.randint(0, i)
+                if j >= size:
+                    continue
+            entry = (i, node_refs(element) if element.tag == 'way' else None)
+            if j < len(reservoir):
+                reservoir[j] = entry
+            else:
+                reservoir.append(entry)
+        for i, way_refs in reservoir:
+            selected.add(i)
+            if way_refs is not None:
+                refs[i] = way_refs
+
+    elif mode == 'bbox':
+        # Nodes come before ways in an OSM file, so by the time a way is
+        # read we already know which of its nodes are inside.
+        inside = set()
+        for i, element in enumerate(iter_elements(in_file)):
+            if element.tag == 'node':
+                if in_bbox(element, bbox):
+                    inside.add(int(element.get('id')))
+                    selected.add(i)
+            elif element.tag == 'way':
+                way_refs = node_refs(element)
+                if any(ref in inside for ref in way_refs):
+                    selected.add(i)
+                    refs[i] = way_refs
+
+    else:
+        raise ValueError("Unknown sampling mode '{}'".format(mode))
+
+    extra_nodes = set()
+    if closed:
+        for way_refs in refs.values():
+            extra_nodes.update(way_refs)
+    return selected, extra_nodes
+
+
+def create_reduced_dataset(in_file, out_file="sample.osm", k=10,
+                           mode='every', size=None, bbox=None, closed=False,
+                           seed=None):
     '''
+    Take as input an OSM file, return back a sized-down version of the file.
+    The sampling mode is one of:
+        'every'      every kth top level element
+        'reservoir'  a uniform random sample of `size` top level elements
+        'bbox'       the nodes inside bbox=(min_lat, min_lon, max_lat, max_lon)
+                     and the ways that reference any of them
+    With closed=True every node referenced by a sampled way is written too,
+    so the sample has no dangling node references.
 
-    def get_element(in_file, tags=('node', 'way', 'relation')):
-        """Yield element if it is the right type of tag
+    Every mode runs in linear time: one pass to choose the elements, one to
+    write them.
 
-        Reference:
-        http://stackoverflow.com/questions/3095434/inserting-newlines-in-xml-file-generated-via-xml-etree-elementtree-in-python
-        """
-        context = iter(ET.iterparse(in_file, events=('start', 'end')))
-        _, root = next(context)
-        for event, elem in context:
-            if event == 'end' and elem.tag in tags:
-                yield elem
-                root.clear()
+    Source: Udacity Data Analysis Nanodegree, Project 3, Project Details
+    '''
+    if mode == 'reservoir' and size is None:
+        raise ValueError("Reservoir sampling needs a sample size.")
+    if mode == 'bbox' and bbox is None:
+        raise ValueError("Bounding box sampling needs a bbox.")
+
+    selected, extra_nodes = select_elements(in_file, mode, k, size, bbox,
+                                            closed, seed)
 
     with open(out_file, 'wb') as output:
         output.write(
@@ -31,10 +116,15 @@ def create_reduced_dataset(in_file, out_file="sample.osm", k=10):
             .encode(encoding='utf-8'))
         output.write('<osm>\n  '.encode(encoding='utf-8'))
 
-        # Write every kth top level element
-        for i, element in enumerate(get_element(in_file)):
-            if i % k == 0:
-                output.write(ET.tostring(element, encoding='utf-8'))
+        for i, element in enumerate(iter_elements(in_file)):
+            if selected is None:
+                keep = i % k == 0
+            else:
+                keep = i in selected
+            if not keep and extra_nodes and element.tag == 'node':
+                keep = int(element.get('id')) in extra_nodes
+            if keep:
+                output.write(tostring(element))
 
         output.write('</osm>'.encode(encoding='utf-8'))
 
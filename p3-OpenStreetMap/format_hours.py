@@ -8,11 +8,12 @@ http://stackoverflow.com/questions/5906984/combine-days-where-opening-hours-are-
 
 LEFT TODO: Replace pm times with 24h, replace hyphens with spaces, remap names.
 '''
-import xml.etree.cElementTree as ET
 import re
 from pprint import pprint
 from collections import defaultdict
 
+from audit_engine import register_auditor, run_audits
+
 test_data = ['24/7',
              'Minday-Friday : 08:00-19:00',
              'Mo-Fr 06:30-18:00; Sa-Su 10:00-16:00',
@@ -32,28 +33,40 @@ test_data = ['24/7',
 
 days_week = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su', 'PubHolBuffer', 'PH']
 
+# Position of each day in the week, for sorting and ranges.
+day_order = {day: i for i, day in enumerate(days_week)}
+
 days_map = {'Minday': 'Mo', 'Monday': 'Mo', 'Friday': 'Fr'}
 # 'Mon': 'Mo', 'Tue': 'Tu', 'Wed': 'We', 'Thu': 'Th', 'Fri': 'Fr',
 # 'Sat': 'Sa', 'Sun': 'Su'}
 
 
+# Compiled once at import rather than on every call.
+# Entries separated by commas instead of semicolons, e.g. "20:00, Tu".
+comma_separator = re.compile(r'(\d+), (\w+)')
+# Where a single digit hour starts after a space, comma or hyphen, e.g. the
+# gap in " 7:45". Zero-width, so the fix is a plain '0' substitution.
+single_digit_hour = re.compile(r'(?<=[ ,-])(?=\d:)')
+day_names = re.compile(r'\b(' + '|'.join(days_map.keys()) + r')\b')
+entry_parts = re.compile(r'^([\w,-]+) (.*)')
+
+
 def clean_sched_string(input_str):
     output = input_str
     # if there are commas separating entries instead of semicolons:
-    pattern = re.compile(r'[\d]+(, )[\w]+')
-    iterator = pattern.finditer(output)
-    for match in iterator:
-        output = "{}; {}".format(output[:match.span()[0] + 2],
-                                 output[match.span()[1] - 2:])
+    if ', ' in output:
+        matches = comma_separator.findall(output)
+        if all(len(d) == 2 and len(w) == 2 for d, w in matches):
+            output = comma_separator.sub(r'\1; \2', output)
+        else:
+            # The original splice assumed two-character tokens either side of
+            # the comma; keep its exact output for the rare strings that don't.
+            for match in comma_separator.finditer(input_str):
+                output = "{}; {}".format(output[:match.span()[0] + 2],
+                                         output[match.span()[1] - 2:])
 
     # make sure all times have leading zero if before 10am
-    pattern = re.compile(r'[ ,-]\d{1}:')
-    iterator = pattern.finditer(output)
-    i = 0
-    for match in iterator:
-        i = i + 1
-        output = "{}0{}".format(output[:match.span()[0] + i],
-                                output[match.span()[0] + i:])
+    output = single_digit_hour.sub('0', output)
 
     # any weird colons laying around?
     output = output.replace(" : ", " ")
@@ -64,9 +77,7 @@ def clean_sched_string(input_str):
 
 
 def abbrev_days(input_str):
-    pattern = re.compile(r'\b(' + '|'.join(days_map.keys()) + r')\b')
-    result = pattern.sub(lambda x: days_map[x.group()], input_str)
-    return result
+    return day_names.sub(lambda x: days_map[x.group()], input_str)
 
 
 def build_hours_dict(input_str):
@@ -94,7 +105,7 @@ def build_hours_dict(input_str):
 
 
 def split_entry(input_str):
-    parts = re.split(r'^([\w,-]+) (.*)', input_str)
+    parts = entry_parts.split(input_str)
     if len(parts) == 4:
         return parts[1], parts[2]
 
@@ -109,8 +120,8 @@ def parse_days(input_str):
     for part in parts:
         if '-' in part:
             dayrange = part.split('-')
-            begin = days_week.index(dayrange[0])
-            end = days_week.index(dayrange[1])
+            begin = day_order[dayrange[0]]
+            end = day_order[dayrange[1]]
             if begin <= end:
                 list_days = list_days + days_week[begin:end + 1]
             elif begin > end:
@@ -127,7 +138,7 @@ def format_days_list(input_list):
     if len(input_list) == 1:
         return input_list[0]
 
-    num_list = [days_week.index(x) for x in input_list]
+    num_list = [day_order[x] for x in input_list]
     diffs = [y - x for x, y in zip(num_list[0:-1], num_list[1:])]
 
     output = input_list[0]
@@ -148,16 +159,11 @@ def format_schedule(input_dict):
         groupby_hours[value].append(key)
 
     for k in groupby_hours:
-        groupby_hours[k] = sorted(
-            groupby_hours[k], key=lambda x: days_week.index(x))
-
-        groupby_hours[k] = format_days_list(groupby_hours[k])
-
-    sched_list = []
-    for k, v in groupby_hours.items():
-        sched_list.append('{} {}'.format(v, k))
+        groupby_hours[k] = format_days_list(
+            sorted(groupby_hours[k], key=day_order.__getitem__))
 
-    sched_list = sorted(sched_list, key=lambda x: days_week.index(x[:2]))
+    sched_list = [v + ' ' + k for k, v in groupby_hours.items()]
+    sched_list.sort(key=lambda x: day_order[x[:2]])
 
     return "; ".join(sched_list)
 
@@ -173,22 +179,37 @@ def parse_opening_hours(input_str):
         return input_str
 
 
+# What an opening_hours value looks like once parse_opening_hours has
+# formatted it, e.g. "Mo-Fr 08:00-18:00; Sa,PH 09:00-13:00,14:00-17:00".
+day_range = r'(?:Mo|Tu|We|Th|Fr|Sa|Su|PH)(?:-(?:Mo|Tu|We|Th|Fr|Sa|Su|PH))?'
+time_range = r'\d\d:\d\d-\d\d:\d\d'
+schedule_entry = r'{0}(?:,{0})* {1}(?:,{1})*'.format(day_range, time_range)
+well_formed_hours = re.compile(r'^{0}(?:; {0})*$'.format(schedule_entry))
+
+
+@register_auditor
+class OpeningHoursAuditor(object):
+    '''
+    Collect opening_hours values that parse_opening_hours can't bring into
+    the standard format. It hands those back as they were, so they are the
+    values that don't match well_formed_hours once parsed.
+    '''
+    name = 'opening_hours'
+    keys = ('opening_hours',)
+
+    def __init__(self):
+        self.bad_strings = []
+
+    def audit_tag(self, k, v):
+        if not well_formed_hours.match(parse_opening_hours(v)):
+            self.bad_strings.append(v)
+
+    def report(self):
+        return self.bad_strings
+
+
 def show_unformattable_hours(file_in):
-    bad_strings = []
-
-    for _, element in ET.iterparse(file_in):
-
-        if element.tag == "node" or element.tag == "way":
-            for tag in element.findall('tag'):
-                if tag.get('k') == 'opening_hours':
-                    k = tag.get('k')
-                    try:
-                        # print("   ", tag.get('v'))
-                        # print("-> ", parse_opening_hours(tag.get('v')))
-                        parse_opening_hours(tag.get('v'))
-                    except:
-                        bad_strings.append(tag.get('v'))
-    pprint(bad_strings)
+    pprint(run_audits(file_in, [OpeningHoursAuditor()])['opening_hours'])
 
 
 if __name__ == '__main__':
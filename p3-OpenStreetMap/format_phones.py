@@ -6,6 +6,9 @@ Adapted from https://www.quora.com/What-is-the-best-way-to-parse-and-standardize
 '''
 
 import re
+
+from audit_engine import register_auditor
+
 testData = [
     "",
     "garbage",
@@ -99,7 +102,138 @@ def parse_phone_number(phone):
         return "+{} {} {}".format(cntry, area, phone_num)
 
 
+def split_unique_numbers(phones, defaultCountryCode="1"):
+    '''
+    split_number_by_parts over a pandas Series of distinct phone strings,
+    using pandas string operations over the whole column.
+    '''
+    import pandas as pd
+    phones = pd.Series(phones, dtype=object).reset_index(drop=True)
+    columns = ['country', 'area', 'number', 'extension']
+    if phones.empty:
+        return pd.DataFrame(columns=columns, dtype=object)
+
+    # Country code: leading +digits, else a lone leading 1, else the default.
+    plus = phones.str.extract(r'^\+(\d+)(.*)', flags=re.DOTALL)
+    one = phones.str.extract(r'^(1)(\D.*)')
+    has_plus = plus[0].notna()
+    has_one = ~has_plus & one[0].notna()
+    country = pd.Series(defaultCountryCode, index=phones.index, dtype=object)
+    country = country.mask(has_plus, plus[0]).mask(has_one, one[0])
+    rest = phones.mask(has_plus, plus[1]).mask(has_one, one[1])
+
+    # Extension: the digits after a word following the number.
+    ext = rest.str.extract(r'^([^a-zA-Z]+)([a-zA-Z]+\D*)(\d+)')
+    has_ext = ext[0].notna()
+    extension = ext[2].where(has_ext, "")
+    rest = ext[0].where(has_ext, rest)
+
+    # Area code and number from the runs of digits that are left.
+    digits = rest.str.findall(r'\d+')
+    n_parts = digits.str.len()
+    halves = digits.str.join(" ").str.partition(" ")
+    first = halves[0]
+    ten_digits = (n_parts == 1) & (first.str.len() == 10)
+    several = n_parts > 1
+
+    area = pd.Series("", index=phones.index, dtype=object)
+    area = area.mask(several, first).mask(ten_digits, first.str[0:3])
+    number = first.mask(several, halves[2])
+    number = number.mask(ten_digits, first.str[3:6] + " " + first.str[6:])
+
+    return pd.DataFrame({'country': country, 'area': area,
+                         'number': number, 'extension': extension},
+                        columns=columns).astype(object)
+
+
+def factorize_phones(phones):
+    '''
+    Codes and distinct values of a list or pandas Series of phone tags, with
+    the index of the Series. Values are compared as strings; missing values
+    get code -1.
+    '''
+    import pandas as pd
+    phones = pd.Series(phones, dtype=object)
+    phones = phones.where(phones.isna(), phones.astype(str))
+    codes, uniques = pd.factorize(phones)
+    return codes, uniques, phones.index
+
+
+def split_numbers(phones, defaultCountryCode="1"):
+    '''
+    Column-wise version of split_number_by_parts for a list or pandas Series
+    of raw phone strings. Returns a DataFrame with country, area, number and
+    extension columns, aligned with the input.
+
+    Phone tags repeat a lot, so each distinct value is parsed once and the
+    result broadcast back to the input rows. Missing values (None or NaN,
+    e.g. untagged rows) get missing components.
+    '''
+    codes, uniques, index = factorize_phones(phones)
+    parts = split_unique_numbers(uniques, defaultCountryCode)
+    # reindex leaves the rows of code -1, the missing values, empty
+    parts = parts.reindex(codes)
+    parts.index = index
+    return parts
+
+
+def parse_phone_numbers(phones):
+    '''
+    Column-wise version of parse_phone_number, returns a Series. Missing
+    values stay missing.
+    '''
+    import pandas as pd
+    codes, uniques, index = factorize_phones(phones)
+    parts = split_unique_numbers(uniques)
+    formatted = "+" + parts['country'] + " " + parts['area'] + " " + \
+        parts['number']
+    formatted = formatted.mask(parts['extension'] != "",
+                               formatted + " Ext. " + parts['extension'])
+    return pd.Series(formatted.reindex(codes).values, index=index,
+                     dtype=object)
+
+
+# What a North American number looks like once it has been through
+# parse_phone_number.
+well_formed_phone = re.compile(r'^\+1 \d{3} \d{3} \d{4}( Ext\. \d+)?$')
+
+
+@register_auditor
+class PhoneAuditor(object):
+    '''Map phone values that don't normalize cleanly to what they become.'''
+    name = 'phones'
+    keys = ('phone',)
+
+    def __init__(self):
+        self.bad_numbers = {}
+
+    def audit_tag(self, k, v):
+        parsed = parse_phone_number(v)
+        if not well_formed_phone.match(parsed):
+            self.bad_numbers[v] = parsed
+
+    def report(self):
+        return self.bad_numbers
+
+
+def test():
+    '''The column-wise functions agree with the per-number ones.'''
+    phones = testData + [None, float('nan')] + testData[::-1]
+    parts = split_numbers(phones)
+    parsed = parse_phone_numbers(phones)
+    for i, telephoneNo in enumerate(phones):
+        if not isinstance(telephoneNo, str):
+            # missing values must not take another row's result
+            assert parts.iloc[i].isna().all(), (telephoneNo, parts.iloc[i])
+            assert parsed.isna().iloc[i], (telephoneNo, parsed.iloc[i])
+            continue
+        assert tuple(parts.iloc[i]) == split_number_by_parts(telephoneNo), \
+            telephoneNo
+        assert parsed.iloc[i] == parse_phone_number(telephoneNo), telephoneNo
+
+
 if __name__ == '__main__':
+    test()
     for telephoneNo in testData:
         print(telephoneNo)
         countryCode, areaCode, phoneNumber, extension = split_number_by_parts(
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Incremental re-processing of an OSM extract.
+
+Every run saves a manifest of the id and version of each node and way next to
+the extract. The next run over a newer extract only shapes the elements whose
+version changed (or that are new), and writes the differences as JSON lines:
+    {"op": "upsert", "doc": {...shaped document...}}
+    {"op": "delete", "type": "node", "id": "2406124091"}
+which mongo_interface.apply_changes can apply to a collection loaded from the
+previous run. The XML still has to be read, but shaping, serializing and
+database writes are proportional to the size of the diff.
+
+The manifest is kept as sorted int64 arrays, 16 bytes per element, rather
+than a dict, so it stays small for metro-sized extracts.
+'''
+from array import array
+from bisect import bisect_left
+import codecs
+import json
+import os
+import struct
+
+from last_store_in_DB import shape_element
+from osm_reader import iter_elements
+
+MANIFEST_TYPES = ('node', 'way')
+
+# Elements without a version attribute always count as changed.
+NO_VERSION = -1
+
+
+def manifest_path(file_in):
+    return "{0}.manifest".format(file_in)
+
+
+def changes_path(file_in):
+    return "{0}.changes.json".format(file_in)
+
+
+class VersionManifest(object):
+    '''Sorted (id, version) arrays for each element type.'''
+
+    def __init__(self):
+        self.ids = {t: array('q') for t in MANIFEST_TYPES}
+        self.versions = {t: array('q') for t in MANIFEST_TYPES}
+        self.in_order = True
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.ids.values())
+
+    def add(self, element_type, element_id, version):
+        ids = self.ids[element_type]
+        if ids and element_id <= ids[-1]:
+            self.in_order = False
+        ids.append(element_id)
+        self.versions[element_type].append(version)
+
+    def sort(self):
+        if self.in_order:
+            return
+        for t in MANIFEST_TYPES:
+            ids, versions = self.ids[t], self.versions[t]
+            order = sorted(range(len(ids)), key=ids.__getitem__)
+            self.ids[t] = array('q', (ids[i] for i in order))
+            self.versions[t] = array('q', (versions[i] for i in order))
+        self.in_order = True
+
+    def version(self, element_type, element_id):
+        '''Version of an element, or None if it isn't in the manifest.'''
+        ids = self.ids[element_type]
+        i = bisect_left(ids, element_id)
+        if i < len(ids) and ids[i] == element_id:
+            return self.versions[element_type][i]
+        return None
+
+    def missing_from(self, other):
+        '''(type, id) of every element in self but not in other.'''
+        for t in MANIFEST_TYPES:
+            ids, other_ids = self.ids[t], other.ids[t]
+            j = 0
+            for element_id in ids:
+                while j < len(other_ids) and other_ids[j] < element_id:
+                    j += 1
+                if j == len(other_ids) or other_ids[j] != element_id:
+                    yield t, element_id
+
+    def save(self, path):
+        self.sort()
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            for t in MANIFEST_TYPES:
+                f.write(struct.pack('<q', len(self.ids[t])))
+                self.ids[t].tofile(f)
+                self.versions[t].tofile(f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        manifest = cls()
+        with open(path, 'rb') as f:
+            for t in MANIFEST_TYPES:
+                n, = struct.unpack('<q', f.read(8))
+                manifest.ids[t].fromfile(f, n)
+                manifest.versions[t].fromfile(f, n)
+        return manifest
+
+
+def element_version(element):
+    version = element.get('version')
+    return NO_VERSION if version is None else int(version)
+
+
+def iter_changes(file_in, previous, current):
+    '''
+    Yield the change records of file_in against the previous manifest,
+    recording every node and way in current as it goes.
+    '''
+    for element in iter_elements(file_in, MANIFEST_TYPES):
+        element_id = int(element.get('id'))
+        version = element_version(element)
+        current.add(element.tag, element_id, version)
+        if version != NO_VERSION and \
+                previous.version(element.tag, element_id) == version:
+            continue
+        doc = shape_element(element)
+        if doc:
+            yield {'op': 'upsert', 'doc': doc}
+
+    current.sort()
+    previous.sort()
+    for element_type, element_id in previous.missing_from(current):
+        yield {'op': 'delete', 'type': element_type, 'id': str(element_id)}
+
+
+def process_changes(file_in, previous_manifest=None, file_out=None,
+                    apply_to=None, batch_size=1000):
+    '''
+    Write the upserts and deletes of file_in relative to the last run to
+    "<file_in>.changes.json" and save its manifest for the next run.
+    previous_manifest is the manifest path of the last run; it defaults to
+    file_in's own, and everything is an upsert if there isn't one yet.
+    If apply_to is a Mongo collection the changes are also applied to it.
+    Returns a dict with the number of upserts and deletes.
+    '''
+    previous_manifest = previous_manifest or manifest_path(file_in)
+    if os.path.exists(previous_manifest):
+        previous = VersionManifest.load(previous_manifest)
+    else:
+        previous = VersionManifest()
+    current = VersionManifest()
+    file_out = file_out or changes_path(file_in)
+
+    counts = {'upsert': 0, 'delete': 0}
+    with codecs.open(file_out, "w") as fo:
+        for change in iter_changes(file_in, previous, current):
+            counts[change['op']] += 1
+            fo.write(json.dumps(change) + "\n")
+
+    if apply_to is not None:
+        from mongo_interface import apply_changes
+        with open(file_out) as fi:
+            apply_changes(apply_to, (json.loads(line) for line in fi),
+                          batch_size)
+
+    current.save(manifest_path(file_in))
+    return counts
+
+
+def test(n_nodes=2000):
+    '''
+    Process a small synthetic extract (see synthetic_osm), then a newer copy
+    of it with some nodes edited and some removed, and check that only those
+    come back as upserts and deletes, and that applying them to an in-memory
+    stand-in for the server loaded from the first run gives the second.
+    '''
+    import shutil
+    import tempfile
+    import xml.etree.ElementTree as ET
+    import mongomock
+    from mongo_interface import load_osm
+    from synthetic_osm import write_synthetic_osm
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        file_old = os.path.join(tmp_dir, 'old.osm')
+        write_synthetic_osm(file_old, n_nodes)
+        counts = process_changes(file_old)
+        assert counts['delete'] == 0
+        assert counts['upsert'] == len(VersionManifest.load(
+            manifest_path(file_old)))
+        # Nothing changed since the last run.
+        assert process_changes(file_old) == {'upsert': 0, 'delete': 0}
+
+        tree = ET.parse(file_old)
+        root = tree.getroot()
+        edited, removed = set(), set()
+        for i, node in enumerate(root.findall('node')):
+            if i % 10 == 5:
+                node.set('version', str(int(node.get('version')) + 1))
+                ET.SubElement(node, 'tag', k='name', v='Edited {0}'.format(i))
+                edited.add(node.get('id'))
+            elif i % 25 == 3:
+                root.remove(node)
+                removed.add(node.get('id'))
+        file_new = os.path.join(tmp_dir, 'new.osm')
+        tree.write(file_new, encoding='utf-8', xml_declaration=True)
+
+        collection = mongomock.MongoClient()['udacity']['toronto']
+        load_osm(file_old, collection.database)
+        counts = process_changes(file_new, manifest_path(file_old),
+                                 apply_to=collection, batch_size=100)
+        with open(changes_path(file_new)) as f:
+            changes = [json.loads(line) for line in f]
+        assert set(c['doc']['id'] for c in changes
+                   if c['op'] == 'upsert') == edited
+        assert set(c['id'] for c in changes if c['op'] == 'delete') == removed
+        assert counts == {'upsert': len(edited), 'delete': len(removed)}
+
+        expected = mongomock.MongoClient()['udacity']['toronto']
+        load_osm(file_new, expected.database)
+        assert collection.count_documents({}) == \
+            expected.count_documents({})
+        for doc in expected.find({'id': {'$in': sorted(edited)}}):
+            del doc['_id']
+            found = collection.find_one({'type': doc['type'], 'id': doc['id']},
+                                        {'_id': 0})
+            assert found == doc, (found, doc)
+        assert collection.count_documents(
+            {'id': {'$in': sorted(removed)}}) == 0
+        print(counts)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    test()
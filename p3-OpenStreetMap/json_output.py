@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+JSON-lines output for process_map.
+
+Documents are encoded straight to bytes, collected in a buffer and written
+in large blocks, optionally through gzip or zstd compression.
+
+By default the standard library serializer is used, which writes exactly what
+json.dumps always has, whatever is installed. orjson (the fastest) or ujson
+can be asked for with serializer= or the OSM_JSON_SERIALIZER environment
+variable. They write compact, UTF-8 JSON (no spaces after separators, no
+\\u escapes): every JSON reader, mongoimport included, sees the same data,
+but the bytes differ from the default output.
+'''
+import gzip
+import json
+import os
+
+SERIALIZERS = ('orjson', 'ujson', 'json')
+
+COMPRESSION = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def default_serializer():
+    '''
+    The serializer to use when none is asked for: OSM_JSON_SERIALIZER if set,
+    else the standard library, so output doesn't depend on what is installed.
+    '''
+    return os.environ.get('OSM_JSON_SERIALIZER') or 'json'
+
+
+def make_encoder(serializer=None, pretty=False):
+    '''A function encoding one document as a line of UTF-8 bytes.'''
+    serializer = serializer or default_serializer()
+    if serializer == 'orjson':
+        import orjson
+        option = orjson.OPT_APPEND_NEWLINE
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return lambda doc: orjson.dumps(doc, option=option)
+    elif serializer == 'ujson':
+        import ujson
+        indent = 2 if pretty else 0
+        return lambda doc: (ujson.dumps(doc, ensure_ascii=False,
+                                        escape_forward_slashes=False,
+                                        indent=indent) + "\n").encode('utf-8')
+    elif serializer == 'json':
+        indent = 2 if pretty else None
+        return lambda doc: (json.dumps(doc, indent=indent) + "\n").encode(
+            'utf-8')
+    raise ValueError("Unknown JSON serializer '{}'".format(serializer))
+
+
+def output_path(file_in, compression=None):
+    return "{0}.json{1}".format(file_in, COMPRESSION[compression])
+
+
+def open_output(file_out, compression=None):
+    if compression is None:
+        return open(file_out, 'wb')
+    elif compression == 'gzip':
+        # Level 6 is zlib's default; 9 is much slower for little gain.
+        return gzip.open(file_out, 'wb', compresslevel=6)
+    elif compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().stream_writer(open(file_out, 'wb'))
+    raise ValueError("Unknown compression '{}'".format(compression))
+
+
+class JsonLinesWriter(object):
+    '''
+    Write documents as JSON lines.
+        with JsonLinesWriter('toronto.osm.json') as writer:
+            writer.write_all(docs)
+    '''
+
+    def __init__(self, file_out, pretty=False, serializer=None,
+                 compression=None, buffer_size=BUFFER_SIZE):
+        self.f = open_output(file_out, compression)
+        self.encode = make_encoder(serializer, pretty)
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+
+    def write_line(self, line):
+        self.buffer.append(line)
+        self.buffered += len(line)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def write(self, doc):
+        self.write_line(self.encode(doc))
+
+    def write_all(self, docs):
+        encode, write_line = self.encode, self.write_line
+        for doc in docs:
+            write_line(encode(doc))
+
+    def flush(self):
+        if self.buffer:
+            self.f.write(b''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
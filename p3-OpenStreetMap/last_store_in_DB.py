@@ -1,14 +1,24 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import xml.etree.cElementTree as ET
 from pprint import pprint
 import re
-import codecs
-import json
+import os
+import shutil
+import sys
+from functools import partial
+from multiprocessing import Pool, cpu_count
 
 from audit_streetnames import *
 from format_hours import *
 from format_phones import *
+from columnar_output import ColumnarWriter, output_path
+from node_index import NodeIndex, NodeIndexBuilder, build_node_index, \
+    index_path
+from json_output import JsonLinesWriter, default_serializer, \
+    output_path as json_output_path
+from normalizer_cache import LRUCache
+from osm_reader import iter_elements
+from pipeline_profiler import PipelineProfiler
 """
 Output looks like:
 {
@@ -47,8 +57,31 @@ problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
 CREATED = ["version", "changeset", "timestamp", "user", "uid"]
 
+# Start of a top level element. In OSM XML a literal '<' can only open a tag
+# (attribute values escape it), and node/way/relation never nest, so any match
+# is a safe place to split the file.
+top_level_start = re.compile(br'<(?:node|way|relation)[\s/>]')
 
-def shape_element(element):
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def classify_key(k):
+    '''Whether a tag key is stored as-is ('lower'), nested ('lower_colon')
+    or skipped (None).'''
+    if problemchars.search(k):
+        return None
+    if lower.match(k):
+        return 'lower'
+    if lower_colon.match(k):
+        return 'lower_colon'
+    return None
+
+
+def shape_element(element, classify=None, parse=None):
+    # classify and parse default to classify_key and parse_tag_cached; they
+    # are parameters so a profiler can time them.
+    classify = classify or classify_key
+    parse = parse or parse_tag_cached
 
     if element.tag == "node" or element.tag == "way":
 
@@ -65,13 +98,12 @@ def shape_element(element):
 
         for tag in element.findall('tag'):
             k = tag.get('k')
-            if problemchars.search(k):
-                continue
+            kind = classify(k)
 
-            if lower.match(k):
-                node[k] = parse_tag(k, tag.get('v'))
+            if kind == 'lower':
+                node[k] = parse(k, tag.get('v'))
 
-            if lower_colon.match(k):
+            elif kind == 'lower_colon':
                 colonkey = k.split(':')
                 prefix = colonkey[0]
                 suffix = colonkey[1]
@@ -80,7 +112,7 @@ def shape_element(element):
                 if prefix not in node:
                     node[prefix] = {}
                 try:
-                    node[prefix][suffix] = parse_tag(suffix, tag.get('v'))
+                    node[prefix][suffix] = parse(suffix, tag.get('v'))
                 except:
                     node[prefix + '_' + suffix] = tag.get('v')
 
@@ -96,23 +128,185 @@ def shape_element(element):
         return None
 
 
-def process_map(file_in, pretty=False):
+def shape_elements(elements, node_index=None, profiler=None):
+    shape = shape_element
+    if profiler is not None:
+        elements = profiler.time_iter(elements, 'xml parse')
+        shape = profiler.timed(
+            partial(shape_element,
+                    classify=profiler.timed(classify_key, 'key checks'),
+                    parse=profiler.timed_by_key(parse_tag_cached,
+                                                'parse_tag')),
+            'shape_element')
+    for element in elements:
+        el = shape(element)
+        if el:
+            if node_index is not None:
+                node_index.attach(element, el)
+            yield el
+
+
+def write_elements(writer, elements, node_index=None, profiler=None):
+    encode, write = writer.encode, writer.write_line
+    if profiler is not None:
+        encode = profiler.timed(encode, 'json serialize')
+        write = profiler.timed(write, 'write')
+    for el in shape_elements(elements, node_index, profiler):
+        write(encode(el))
+
+
+def process_map(file_in, pretty=False, geometry=False, fmt='json',
+                profiler=None, serializer=None, compression=None):
     # You do not need to change this file
-    file_out = "{0}.json".format(file_in)
+    # With geometry=True ways also get "node_pos" (the [lat, lon] of each
+    # node_ref found), "centroid" and "bbox"; the node index is built on disk
+    # from the nodes in the same pass, since they come before the ways.
+    # fmt='parquet' or 'arrow' writes "<file_in>.parquet" / "<file_in>.arrow"
+    # instead of JSON lines; see columnar_output. JSON lines are encoded with
+    # the standard library unless serializer='orjson' or 'ujson' (faster,
+    # compact output) is asked for, and compression='gzip' or 'zstd' writes
+    # "<file_in>.json.gz" or "<file_in>.json.zst"; see json_output.
+    # Pass a pipeline_profiler.PipelineProfiler to time each stage.
     data = []
-    with codecs.open(file_out, "w") as fo:
-        for _, element in ET.iterparse(file_in, events=("start",)):
-            el = shape_element(element)
-            if el:
-                # data.append(el)
-                if pretty:
-                    fo.write(json.dumps(el, indent=2)+"\n")
-                else:
-                    fo.write(json.dumps(el) + "\n")
-            element.clear()
+    node_index = NodeIndexBuilder(index_path(file_in)) if geometry else None
+    if fmt == 'json':
+        file_out = json_output_path(file_in, compression)
+        with JsonLinesWriter(file_out, pretty, serializer,
+                             compression) as writer:
+            write_elements(writer, iter_elements(file_in), node_index,
+                           profiler)
+    else:
+        with ColumnarWriter(output_path(file_in, fmt), fmt) as writer:
+            writer.write_all(shape_elements(iter_elements(file_in),
+                                            node_index, profiler))
+    if node_index is not None:
+        node_index.finish().close()
     return data
 
 
+class RangeReader(object):
+    '''
+    File-like view of bytes [start, end) of an OSM file, wrapped in a bare
+    <osm> root so that it parses as a document on its own.
+    '''
+
+    def __init__(self, file_in, start, end):
+        self.f = open(file_in, 'rb')
+        self.f.seek(start)
+        self.remaining = end - start
+        self.parts = [b'<osm>', None, b'</osm>']
+
+    def read(self, size=-1):
+        while self.parts:
+            part = self.parts[0]
+            if part is not None:
+                self.parts.pop(0)
+                return part
+            n = self.remaining if size < 0 else min(size, self.remaining)
+            data = self.f.read(n) if n > 0 else b''
+            self.remaining -= len(data)
+            if data:
+                return data
+            self.parts.pop(0)
+            self.f.close()
+        return b''
+
+
+def find_element_start(f, offset, block_size=1024 * 1024):
+    '''Return the offset of the first top level element at or after offset.'''
+    overlap = 16
+    f.seek(offset)
+    while True:
+        block = f.read(block_size)
+        m = top_level_start.search(block)
+        if m:
+            return offset + m.start()
+        if len(block) < block_size:
+            return None
+        offset += len(block) - overlap
+        f.seek(offset)
+
+
+def find_chunks(file_in, n_chunks):
+    '''
+    Split an OSM file into at most n_chunks byte ranges, each starting on a
+    top level <node>, <way> or <relation> and the last ending at </osm>.
+    '''
+    size = os.path.getsize(file_in)
+    with open(file_in, 'rb') as f:
+        first = find_element_start(f, 0)
+        if first is None:
+            return []
+        f.seek(max(0, size - 4096))
+        tail = f.read()
+        end = tail.rfind(b'</osm>')
+        end = size if end == -1 else size - len(tail) + end
+
+        bounds = [first]
+        for i in range(1, n_chunks):
+            target = first + (end - first) * i // n_chunks
+            pos = find_element_start(f, max(target, bounds[-1] + 1))
+            if pos is None or pos >= end:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+        bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def process_chunk(args):
+    (file_in, start, end, file_out, pretty, node_index_path, serializer,
+     compression) = args
+    node_index = NodeIndex(node_index_path) if node_index_path else None
+    with JsonLinesWriter(file_out, pretty, serializer, compression) as writer:
+        write_elements(writer,
+                       iter_elements(RangeReader(file_in, start, end)),
+                       node_index)
+    if node_index is not None:
+        node_index.close()
+    return file_out
+
+
+def process_map_parallel(file_in, pretty=False, processes=None, shards=False,
+                         geometry=False, serializer=None, compression=None):
+    '''
+    Multi-process version of process_map. The file is split into byte ranges
+    aligned on top level elements, each range is shaped by a worker, and the
+    per-range outputs are either concatenated in order into the same
+    "<file_in>.json" the serial path writes, or left as numbered shards when
+    shards=True. Returns the list of files written.
+
+    With geometry=True the node index is built first, in a pass over the
+    nodes only, and every worker memory-maps the same index files.
+    Compressed shards are concatenated as they are: a sequence of gzip
+    members or zstd frames is itself a valid compressed file.
+    '''
+    file_out = json_output_path(file_in, compression)
+    serializer = serializer or default_serializer()
+    processes = processes or cpu_count()
+    n_chunks = max(processes * 4, os.path.getsize(file_in) // CHUNK_SIZE)
+    node_index_path = None
+    if geometry:
+        node_index_path = index_path(file_in)
+        build_node_index(file_in, node_index_path).close()
+    tasks = [(file_in, start, end, "{0}.{1:05d}".format(file_out, i), pretty,
+              node_index_path, serializer, compression)
+             for i, (start, end) in enumerate(find_chunks(file_in, n_chunks))]
+
+    with Pool(processes) as pool:
+        shard_files = list(pool.imap(process_chunk, tasks))
+
+    if shards:
+        return shard_files
+
+    with open(file_out, 'wb') as fo:
+        for shard in shard_files:
+            with open(shard, 'rb') as fi:
+                shutil.copyfileobj(fi, fo)
+            os.remove(shard)
+    return [file_out]
+
+
 def parse_tag(key, val):
     if key == 'city':
         try:
@@ -135,15 +329,34 @@ def parse_tag(key, val):
         return val
 
 
-def test():
+# Keys whose values go through a regex normalizer in parse_tag; the rest are
+# returned as-is or replaced by a constant and aren't worth caching.
+CACHED_KEYS = set(['city', 'street', 'phone', 'opening_hours'])
+
+tag_cache = LRUCache(parse_tag, maxsize=100000)
+
+
+def parse_tag_cached(key, val):
+    if key in CACHED_KEYS:
+        return tag_cache(key, val)
+    return parse_tag(key, val)
+
+
+def test(profile=False):
     # NOTE: if you are running this code on your computer, with a larger dataset,
     # call the process_map procedure with pretty=False. The pretty=True option adds
     # additional spaces to the output, making it significantly larger.
-    data = process_map('toronto_canada.osm', False)
+    profiler = PipelineProfiler() if profile else None
+    data = process_map('toronto_canada.osm', False, profiler=profiler)
+    pprint(tag_cache.stats())
+    if profiler is not None:
+        profiler.print_summary()
+        profiler.dump('toronto_canada.osm.profile.json')
     #data_mini = [
     #    x for x in data if 'address' in x or 'phone' in x or 'opening_hours' in x]
     #pprint(data_mini)
 
 
 if __name__ == "__main__":
-    test()
+    # python last_store_in_DB.py --profile  prints where the time goes
+    test(profile='--profile' in sys.argv)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+On-disk node id -> (lat, lon) index, so ways can be given their geometry
+without a join against every node.
+
+The index is two flat files next to each other:
+    <path>.ids     node ids, sorted, as native int64
+    <path>.coords  lat, lon pairs in the same order, as native float64
+Both are memory-mapped when read. A lookup is a direct offset when the ids
+are contiguous and a binary search otherwise, so the index scales to tens of
+millions of nodes without holding a Python dict.
+'''
+from array import array
+from bisect import bisect_left
+import mmap
+import os
+
+from osm_reader import iter_elements
+
+FLUSH_EVERY = 100000
+
+
+class NodeIndexBuilder(object):
+    '''
+    Append nodes as they stream past, then call finish() to get a NodeIndex.
+    OSM files list nodes in id order; if they turn out not to be, finish()
+    sorts the index, which needs it in memory once.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.ids_file = open(path + '.ids', 'wb')
+        self.coords_file = open(path + '.coords', 'wb')
+        self.ids = array('q')
+        self.coords = array('d')
+        self.last_id = None
+        self.in_order = True
+        self.index = None
+
+    def add(self, node_id, lat, lon):
+        if self.last_id is not None and node_id <= self.last_id:
+            self.in_order = False
+        self.last_id = node_id
+        self.ids.append(node_id)
+        self.coords.append(lat)
+        self.coords.append(lon)
+        if len(self.ids) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        self.ids.tofile(self.ids_file)
+        self.coords.tofile(self.coords_file)
+        self.ids = array('q')
+        self.coords = array('d')
+
+    def finish(self):
+        if self.index is None:
+            self.flush()
+            self.ids_file.close()
+            self.coords_file.close()
+            if not self.in_order:
+                sort_index(self.path)
+            self.index = NodeIndex(self.path)
+        return self.index
+
+    def attach(self, element, doc):
+        '''Stream hook for process_map: index nodes, give ways geometry.'''
+        if element.tag == 'node':
+            if self.index is None:
+                add_node(self, element)
+        elif element.tag == 'way':
+            self.finish().attach(element, doc)
+
+
+def add_node(builder, element):
+    lat, lon = element.get('lat'), element.get('lon')
+    if lat is not None and lon is not None:
+        builder.add(int(element.get('id')), float(lat), float(lon))
+
+
+def sort_index(path):
+    ids = array('q')
+    coords = array('d')
+    with open(path + '.ids', 'rb') as f:
+        ids.frombytes(f.read())
+    with open(path + '.coords', 'rb') as f:
+        coords.frombytes(f.read())
+
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    sorted_ids = array('q', (ids[i] for i in order))
+    sorted_coords = array('d')
+    for i in order:
+        sorted_coords.append(coords[2 * i])
+        sorted_coords.append(coords[2 * i + 1])
+
+    with open(path + '.ids', 'wb') as f:
+        sorted_ids.tofile(f)
+    with open(path + '.coords', 'wb') as f:
+        sorted_coords.tofile(f)
+
+
+def map_array(file_name, typecode):
+    '''Memory-map a file of native values as a read-only memoryview.'''
+    if os.path.getsize(file_name) == 0:
+        return memoryview(array(typecode)), None
+    with open(file_name, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped).cast(typecode), mapped
+
+
+class NodeIndex(object):
+    def __init__(self, path):
+        self.path = path
+        self.ids, self.ids_map = map_array(path + '.ids', 'q')
+        self.coords, self.coords_map = map_array(path + '.coords', 'd')
+        n = len(self.ids)
+        # Contiguous ids (common in extracts and test files) need no search.
+        self.first_id = self.ids[0] if n else 0
+        self.contiguous = n > 0 and self.ids[n - 1] - self.first_id == n - 1
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, node_id):
+        if self.contiguous:
+            i = node_id - self.first_id
+            return i if 0 <= i < len(self.ids) else None
+        i = bisect_left(self.ids, node_id)
+        if i < len(self.ids) and self.ids[i] == node_id:
+            return i
+        return None
+
+    def lookup(self, node_id):
+        '''(lat, lon) of a node, or None if it isn't in the index.'''
+        i = self.position(int(node_id))
+        if i is None:
+            return None
+        return self.coords[2 * i], self.coords[2 * i + 1]
+
+    def lookup_many(self, node_ids):
+        '''Coordinates of the nodes that are in the index, in order.'''
+        coords = []
+        for node_id in node_ids:
+            pos = self.lookup(node_id)
+            if pos is not None:
+                coords.append(list(pos))
+        return coords
+
+    def attach(self, element, doc):
+        '''Stream hook for process_map: give ways their geometry.'''
+        if element.tag == 'way' and 'node_refs' in doc:
+            doc.update(way_geometry(self.lookup_many(doc['node_refs'])))
+
+    def close(self):
+        self.ids.release()
+        self.coords.release()
+        for mapped in (self.ids_map, self.coords_map):
+            if mapped is not None:
+                mapped.close()
+
+
+def way_geometry(coords):
+    '''Resolved node positions, centroid and bbox of a way's coordinates.'''
+    if not coords:
+        return {}
+    lats = [lat for lat, _ in coords]
+    lons = [lon for _, lon in coords]
+    return {'node_pos': coords,
+            'centroid': [sum(lats) / len(lats), sum(lons) / len(lons)],
+            'bbox': [min(lats), min(lons), max(lats), max(lons)]}
+
+
+def index_path(file_in):
+    return "{0}.nodes".format(file_in)
+
+
+def build_node_index(file_in, path=None):
+    '''Index every node of an OSM file in one streaming pass.'''
+    builder = NodeIndexBuilder(path or index_path(file_in))
+    for element in iter_elements(file_in, ('node',)):
+        add_node(builder, element)
+    return builder.finish()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Bounded LRU cache for the tag value normalizers.
+
+The same street names, phone numbers and opening hours strings repeat
+thousands of times in a metro extract, so remembering what each
+(tag key, raw value) pair normalizes to saves most of the regex work.
+'''
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''
+    Wrap func(key, val) with a least-recently-used cache of at most maxsize
+    entries. Exceptions raised by func are passed through and not cached.
+    '''
+
+    def __init__(self, func, maxsize=100000):
+        self.func = func
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, key, val):
+        try:
+            result = self.entries[(key, val)]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self.entries.move_to_end((key, val))
+            return result
+
+        self.misses += 1
+        result = self.func(key, val)
+        self.entries[(key, val)] = result
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'maxsize': self.maxsize}
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Evaluate MongoDB aggregation pipelines directly over the JSON-lines output
+of process_map, without a database.
+
+Supported stages: $match, $group, $sort, $limit, $skip. Stages up to the
+first $group or $sort are streamed a document at a time, $group keeps only
+one accumulator per group, and a $sort followed by a $limit keeps only the
+top k documents in a heap.
+
+Repeat reports counting the values of a field (name, amenity, address.city)
+are answered from a small rollup file when one has been built with
+build_rollups and is still fresh.
+'''
+from functools import cmp_to_key
+import heapq
+from itertools import islice
+import json
+import os
+import pprint
+
+MISSING = object()
+
+ROLLUP_KEYS = ['name', 'amenity', 'address.city']
+
+
+def rollup_path(file_in):
+    return "{0}.rollup".format(file_in)
+
+
+def iter_documents(file_in):
+    with open(file_in) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def hashable(value):
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def get_field(doc, path):
+    '''Value at a dotted path, or MISSING.'''
+    for part in path.split('.'):
+        if not isinstance(doc, dict) or part not in doc:
+            return MISSING
+        doc = doc[part]
+    return doc
+
+
+def type_rank(value):
+    '''Rank of a value's type in MongoDB's sort order.'''
+    if value is MISSING or value is None:
+        return 0
+    if isinstance(value, bool):
+        return 5
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    return 6
+
+
+def compare_values(a, b):
+    rank_a, rank_b = type_rank(a), type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if rank_a == 0:
+        return 0
+    if rank_a not in (1, 2, 5):
+        # Documents and arrays: any consistent order will do here.
+        a, b = hashable(a), hashable(b)
+    return (a > b) - (a < b)
+
+
+def values_equal(a, b):
+    return type_rank(a) == type_rank(b) and compare_values(a, b) == 0
+
+
+def match_value(value, condition):
+    '''Whether a field value satisfies one query condition.'''
+    if isinstance(condition, dict) and condition and \
+            all(k.startswith('$') for k in condition):
+        return all(match_operator(value, op, arg)
+                   for op, arg in condition.items())
+    return match_operator(value, '$eq', condition)
+
+
+def match_operator(value, op, arg):
+    if op == '$exists':
+        return (value is not MISSING) == bool(arg)
+    if op == '$eq':
+        if arg is None:
+            return value is MISSING or value is None
+        if isinstance(value, list) and not isinstance(arg, list):
+            return any(values_equal(v, arg) for v in value)
+        return value is not MISSING and values_equal(value, arg)
+    if op == '$ne':
+        return not match_operator(value, '$eq', arg)
+    if op == '$in':
+        return any(match_operator(value, '$eq', a) for a in arg)
+    if op == '$nin':
+        return not match_operator(value, '$in', arg)
+    if op in ('$gt', '$gte', '$lt', '$lte'):
+        if value is MISSING or type_rank(value) != type_rank(arg):
+            return False
+        c = compare_values(value, arg)
+        return {'$gt': c > 0, '$gte': c >= 0,
+                '$lt': c < 0, '$lte': c <= 0}[op]
+    raise ValueError("Unsupported query operator {}".format(op))
+
+
+def match(doc, query):
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(match(doc, q) for q in condition):
+                return False
+        elif key == '$and':
+            if not all(match(doc, q) for q in condition):
+                return False
+        elif key == '$nor':
+            if any(match(doc, q) for q in condition):
+                return False
+        elif not match_value(get_field(doc, key), condition):
+            return False
+    return True
+
+
+def evaluate(doc, expr):
+    '''Value of a group expression: '$field', a dict of them, or a constant.'''
+    if isinstance(expr, str) and expr.startswith('$'):
+        value = get_field(doc, expr[1:])
+        return None if value is MISSING else value
+    if isinstance(expr, dict):
+        return {k: evaluate(doc, v) for k, v in expr.items()}
+    return expr
+
+
+def group(docs, spec):
+    groups = {}
+    accumulators = [(field, op, arg) for field, acc in spec.items()
+                    if field != '_id' for op, arg in acc.items()]
+
+    for doc in docs:
+        _id = evaluate(doc, spec['_id'])
+        key = hashable(_id)
+        if key not in groups:
+            out = {'_id': _id}
+            for field, op, _ in accumulators:
+                out[field] = {'$sum': 0, '$avg': [0, 0], '$push': [],
+                              '$addToSet': [], '$first': MISSING,
+                              '$min': MISSING, '$max': MISSING,
+                              '$last': None}.get(op)
+            groups[key] = out
+        out = groups[key]
+
+        for field, op, arg in accumulators:
+            value = evaluate(doc, arg)
+            if op == '$sum':
+                if isinstance(value, (int, float)) and \
+                        not isinstance(value, bool):
+                    out[field] += value
+            elif op == '$avg':
+                if isinstance(value, (int, float)) and \
+                        not isinstance(value, bool):
+                    out[field][0] += value
+                    out[field][1] += 1
+            elif op in ('$min', '$max'):
+                if value is not None:
+                    current = out[field]
+                    c = 0 if current is MISSING else \
+                        compare_values(value, current)
+                    if current is MISSING or (c < 0 if op == '$min'
+                                              else c > 0):
+                        out[field] = value
+            elif op == '$first':
+                if out[field] is MISSING:
+                    out[field] = value
+            elif op == '$last':
+                out[field] = value
+            elif op == '$push':
+                out[field].append(value)
+            elif op == '$addToSet':
+                if not any(values_equal(value, v) for v in out[field]):
+                    out[field].append(value)
+            else:
+                raise ValueError("Unsupported accumulator {}".format(op))
+
+    for out in groups.values():
+        for field, op, _ in accumulators:
+            if op == '$avg':
+                total, n = out[field]
+                out[field] = total / n if n else None
+            elif out[field] is MISSING:
+                out[field] = None
+        yield out
+
+
+def sort_key(spec):
+    def compare(a, b):
+        for field, direction in spec.items():
+            c = compare_values(get_field(a, field), get_field(b, field))
+            if c:
+                return c if direction > 0 else -c
+        return 0
+    return cmp_to_key(compare)
+
+
+def run_pipeline(docs, pipeline):
+    '''Apply the pipeline stages to an iterable of documents.'''
+    stages = list(pipeline)
+    i = 0
+    while i < len(stages):
+        (name, spec), = stages[i].items()
+        if name == '$match':
+            docs = filter(lambda doc, query=spec: match(doc, query), docs)
+        elif name == '$group':
+            docs = group(docs, spec)
+        elif name == '$sort':
+            following = stages[i + 1] if i + 1 < len(stages) else {}
+            if '$limit' in following:
+                # Top-k: keep only the best `limit` documents in a heap.
+                docs = iter(heapq.nsmallest(following['$limit'], docs,
+                                            key=sort_key(spec)))
+                i += 1
+            else:
+                docs = iter(sorted(docs, key=sort_key(spec)))
+        elif name == '$limit':
+            docs = islice(docs, spec)
+        elif name == '$skip':
+            docs = islice(docs, spec, None)
+        else:
+            raise ValueError("Unsupported pipeline stage {}".format(name))
+        i += 1
+    return list(docs)
+
+
+def build_rollups(file_in, keys=ROLLUP_KEYS):
+    '''
+    Count the values of each key in one pass over file_in and save them next
+    to it, along with the size and modification time of file_in so a stale
+    rollup is never used. Counts are kept in order of first appearance, with
+    documents missing the key counted as a separate entry.
+    '''
+    counts = {key: {} for key in keys}
+    for doc in iter_documents(file_in):
+        for key in keys:
+            value = get_field(doc, key)
+            # [value, count, whether the key was present]
+            h = 'missing' if value is MISSING else hashable(value)
+            if h in counts[key]:
+                counts[key][h][1] += 1
+            else:
+                counts[key][h] = [None if value is MISSING else value, 1,
+                                  value is not MISSING]
+
+    stat = os.stat(file_in)
+    rollups = {'source_size': stat.st_size,
+               'source_mtime': stat.st_mtime,
+               'keys': {key: list(counts[key].values()) for key in keys}}
+    with open(rollup_path(file_in), 'w') as f:
+        json.dump(rollups, f)
+    return rollups
+
+
+def load_rollups(file_in):
+    '''The rollups saved for file_in, or None if absent or out of date.'''
+    try:
+        with open(rollup_path(file_in)) as f:
+            rollups = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    stat = os.stat(file_in)
+    if rollups['source_size'] != stat.st_size or \
+            rollups['source_mtime'] != stat.st_mtime:
+        return None
+    return rollups
+
+
+def rollup_query(pipeline, rollups):
+    '''
+    Answer a pipeline that counts the values of a rolled up field,
+        {'$match': {key: {'$ne': None}}}    (or {'$exists': 1}; optional)
+        {'$group': {'_id': '$key', 'count': {'$sum': 1}}}
+        ... any further stages ...
+    from the rollups, returning exactly what run_pipeline would. Returns None
+    when the pipeline doesn't start that way.
+    '''
+    stages = list(pipeline)
+    condition = None
+    if stages and '$match' in stages[0]:
+        spec = stages.pop(0)['$match']
+        if len(spec) != 1:
+            return None
+        (match_key, condition), = spec.items()
+        if condition not in ({'$ne': None}, {'$exists': 1},
+                             {'$exists': True}):
+            return None
+
+    if not stages or '$group' not in stages[0]:
+        return None
+    spec = stages.pop(0)['$group']
+    _id = spec.get('_id')
+    if len(spec) != 2 or spec.get('count') != {'$sum': 1} or \
+            not isinstance(_id, str) or not _id.startswith('$'):
+        return None
+    key = _id[1:]
+    if key not in rollups['keys'] or \
+            (condition is not None and match_key != key):
+        return None
+
+    docs = []
+    null = None
+    for value, n, present in rollups['keys'][key]:
+        if condition == {'$ne': None} and value is None:
+            continue
+        if condition is not None and not present:
+            continue
+        if value is None:
+            # Missing fields and explicit nulls share a group, as in MongoDB.
+            if null is None:
+                null = {'_id': None, 'count': 0}
+                docs.append(null)
+            null['count'] += n
+        else:
+            docs.append({'_id': value, 'count': n})
+    return run_pipeline(docs, stages)
+
+
+def aggregate_offline(file_in, pipeline, use_rollups=True):
+    '''Run pipeline over the JSON-lines file_in, like db.toronto.aggregate.'''
+    if use_rollups:
+        rollups = load_rollups(file_in)
+        if rollups is not None:
+            result = rollup_query(pipeline, rollups)
+            if result is not None:
+                return result
+    return run_pipeline(iter_documents(file_in), pipeline)
+
+
+def test(file_in=None, n_nodes=2000):
+    '''
+    Run a pipeline over file_in, a process_map output, with and without
+    rollups. By default the output of a small synthetic extract (see
+    synthetic_osm) is made and removed afterwards.
+    '''
+    import shutil
+    import tempfile
+    from last_store_in_DB import process_map
+    from synthetic_osm import write_synthetic_osm
+
+    tmp_dir = None
+    if file_in is None:
+        tmp_dir = tempfile.mkdtemp()
+        file_osm = os.path.join(tmp_dir, 'synthetic.osm')
+        write_synthetic_osm(file_osm, n_nodes)
+        process_map(file_osm)
+        file_in = file_osm + '.json'
+    pipeline = [{'$match': {'name': {'$ne': None}}},
+                {'$group': {'_id': '$name',
+                            'count': {'$sum': 1}}},
+                {'$sort': {'count': -1}},
+                {'$limit': 1}]
+    try:
+        result = aggregate_offline(file_in, pipeline, use_rollups=False)
+        pprint.pprint(result)
+        build_rollups(file_in)
+        assert load_rollups(file_in) is not None
+        assert aggregate_offline(file_in, pipeline) == result
+        pprint.pprint(result)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Streaming reader for OSM XML files, shared by the audit, cleaning and
+sampling scripts.
+
+Elements are yielded on their "end" event, so all of their <tag>, <nd> and
+<member> children are present. Once the caller moves on, the element is
+cleared and dropped from the root, so memory stays constant no matter how
+large the extract is.
+
+Three parser backends are available:
+    'etree'  xml.etree.ElementTree.iterparse (the default)
+    'lxml'   lxml.etree.iterparse, leaving the <tag>, <nd> and <member>
+             children to lxml
+    'expat'  a raw expat parser that only builds Element objects for the
+             elements that are asked for, and never keeps text or whitespace
+Pick one per call with backend=, or for every script at once with
+set_backend or the OSM_PARSER_BACKEND environment variable (which also
+reaches the process_map_parallel workers).
+
+Reference:
+http://stackoverflow.com/questions/7697710/python-running-out-of-memory-parsing-xml-using-celementtree-iterparse
+'''
+import os
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+TOP_LEVEL = ('node', 'way', 'relation')
+
+BACKENDS = ('etree', 'lxml', 'expat')
+
+READ_SIZE = 1024 * 1024
+
+
+def set_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError("Unknown parser backend '{}'".format(backend))
+    os.environ['OSM_PARSER_BACKEND'] = backend
+
+
+def get_backend():
+    return os.environ.get('OSM_PARSER_BACKEND', 'etree')
+
+
+def iter_elements(file_in, tags=TOP_LEVEL, backend=None):
+    '''
+    Yield every complete top level element of file_in whose tag is in tags.
+    file_in may be a path or a binary file-like object.
+
+    An element is only valid until the next one is requested: it is cleared,
+    together with any skipped top level siblings, as soon as the loop resumes.
+    '''
+    backend = backend or get_backend()
+    if backend == 'etree':
+        return iter_etree(file_in, tags)
+    elif backend == 'lxml':
+        return iter_lxml(file_in, tags)
+    elif backend == 'expat':
+        return iter_expat(file_in, tags)
+    raise ValueError("Unknown parser backend '{}'".format(backend))
+
+
+def iter_etree(file_in, tags=TOP_LEVEL):
+    context = ET.iterparse(file_in, events=('start', 'end'))
+    _, root = next(context)
+    depth = 0
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 0:
+            if elem.tag in tags:
+                yield elem
+            elem.clear()
+            root.clear()
+
+
+def iter_lxml(file_in, tags=TOP_LEVEL):
+    from lxml import etree
+    # Only the top level elements reach Python, not their <tag> and <nd>
+    # children. That includes every node, way and relation, even when not
+    # asked for: the skipped ones have to be cleared here too.
+    wanted = tuple(set(tags) | set(TOP_LEVEL))
+    for _, elem in etree.iterparse(file_in, events=('end',), tag=wanted):
+        parent = elem.getparent()
+        if parent is None or parent.getparent() is not None:
+            continue
+        if elem.tag in tags:
+            yield elem
+        elem.clear()
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def iter_expat(file_in, tags=TOP_LEVEL):
+    ready = []
+    stack = []      # elements being built, outermost first
+    depth = 0
+    Element, SubElement = ET.Element, ET.SubElement
+
+    def start(name, attrs):
+        nonlocal depth
+        depth += 1
+        if stack:
+            stack.append(SubElement(stack[-1], name, attrs))
+        elif depth == 2 and name in tags:
+            stack.append(Element(name, attrs))
+
+    def end(name):
+        nonlocal depth
+        depth -= 1
+        if stack:
+            elem = stack.pop()
+            if not stack:
+                ready.append(elem)
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+
+    f = open(file_in, 'rb') if isinstance(file_in, str) else file_in
+    try:
+        while True:
+            data = f.read(READ_SIZE)
+            parser.Parse(data, not data)
+            for elem in ready:
+                yield elem
+            del ready[:]
+            if not data:
+                break
+    finally:
+        if f is not file_in:
+            f.close()
+
+
+def tostring(element):
+    '''Serialize an element from any backend to UTF-8 bytes.'''
+    if hasattr(element, 'getparent'):
+        from lxml import etree
+        return etree.tostring(element, encoding='utf-8',
+                              xml_declaration=False)
+    return ET.tostring(element, encoding='utf-8')
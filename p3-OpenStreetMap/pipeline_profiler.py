@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Opt-in instrumentation for the shaping pipeline.
+
+A PipelineProfiler records cumulative time and call counts per stage, and
+per tag key for the normalizers, plus elements/sec and peak RSS:
+
+    profiler = PipelineProfiler()
+    process_map('toronto_canada.osm', profiler=profiler)
+    profiler.print_summary()
+    profiler.dump('profile.json')
+
+Times are inclusive: "shape_element" contains "key checks" and the
+"parse_tag[...]" entries. Timing every call has its own cost, so a profiled
+run is slower than an unprofiled one; the proportions are what matter.
+'''
+from collections import defaultdict
+import json
+import resource
+import sys
+import time
+
+perf_counter = time.perf_counter
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024. / (1024 if sys.platform == 'darwin' else 1)
+
+
+class PipelineProfiler(object):
+
+    def __init__(self):
+        self.stages = defaultdict(lambda: [0.0, 0])  # name -> [seconds, calls]
+        self.elements = 0
+        self.started = perf_counter()
+        self.finished = None
+
+    def add(self, stage, seconds):
+        entry = self.stages[stage]
+        entry[0] += seconds
+        entry[1] += 1
+
+    def timed(self, func, stage):
+        '''func, with each call timed under stage.'''
+        entry = self.stages[stage]
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                entry[0] += perf_counter() - start
+                entry[1] += 1
+        return wrapper
+
+    def timed_by_key(self, func, stage):
+        '''func(key, ...), with each call timed under "stage[key]".'''
+        stages = self.stages
+
+        def wrapper(key, *args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(key, *args, **kwargs)
+            finally:
+                entry = stages['{}[{}]'.format(stage, key)]
+                entry[0] += perf_counter() - start
+                entry[1] += 1
+        return wrapper
+
+    def time_iter(self, iterable, stage):
+        '''Yield from iterable, timing each step under stage.'''
+        entry = self.stages[stage]
+        it = iter(iterable)
+        while True:
+            start = perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                break
+            finally:
+                entry[0] += perf_counter() - start
+                entry[1] += 1
+            self.elements += 1
+            yield item
+        self.finished = perf_counter()
+
+    def summary(self):
+        elapsed = (self.finished or perf_counter()) - self.started
+        return {
+            'elapsed': elapsed,
+            'elements': self.elements,
+            'elements_per_sec': self.elements / elapsed if elapsed else 0.,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': {name: {'seconds': seconds, 'calls': calls}
+                       for name, (seconds, calls) in self.stages.items()}}
+
+    def print_summary(self):
+        summary = self.summary()
+        print("{:d} elements in {:.2f}s, {:.0f} elements/sec, "
+              "peak RSS {:.1f} MB".format(
+                  summary['elements'], summary['elapsed'],
+                  summary['elements_per_sec'], summary['peak_rss_mb']))
+        stages = sorted(summary['stages'].items(),
+                        key=lambda item: -item[1]['seconds'])
+        for name, stage in stages:
+            print("  {:<32} {:9.3f}s {:6.1f}% {:10d} calls".format(
+                name, stage['seconds'],
+                100. * stage['seconds'] / summary['elapsed'],
+                stage['calls']))
+
+    def dump(self, file_out):
+        with open(file_out, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
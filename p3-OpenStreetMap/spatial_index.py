@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Local spatial index over the shaped documents written by process_map.
+
+A SpatialIndex is a uniform grid held in NumPy arrays: the points sorted by
+grid cell, and the offset of each cell in that order. Queries only look at
+the cells they overlap, so bounding box, radius and nearest-neighbour
+queries take milliseconds over millions of points, with no database.
+
+    index = SpatialIndex.from_json_lines('toronto_canada.osm.json',
+                                         {'amenity': 'cafe'})
+    index.ids[index.radius(43.6532, -79.3832, 500)]
+    index.ids[index.nearest(43.6532, -79.3832, k=5)]
+
+assign_polygons labels every point with the polygon it falls in, e.g. the
+township boundaries (ways with boundary=administrative, which carry a
+node_pos when process_map runs with geometry=True; see load_boundaries).
+'''
+import numpy as np
+
+from offline_aggregate import iter_documents, match
+
+EARTH_RADIUS = 6371008.8     # metres
+
+POINTS_PER_CELL = 16
+
+
+def haversine(lat, lon, lats, lons):
+    '''Great circle distances in metres from (lat, lon) to arrays of points.'''
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + \
+        np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+
+
+def degrees_around(lat, metres):
+    '''Half-widths in degrees of latitude and longitude of a circle.'''
+    dlat = np.degrees(metres / EARTH_RADIUS)
+    coslat = max(np.cos(np.radians(lat)), 1e-6)
+    return dlat, min(dlat / coslat, 360.)
+
+
+def as_rings(rings):
+    '''A polygon as a list of rings, whether given as one ring or several.'''
+    first = rings[0]
+    if len(first) == 2 and not hasattr(first[0], '__len__'):
+        return [rings]
+    return list(rings)
+
+
+def points_in_polygon(lats, lons, rings):
+    '''
+    Even-odd ray casting of arrays of points against a polygon given as one
+    ring, or a list of rings (holes included), of [lat, lon] vertices.
+    '''
+    inside = np.zeros(len(lats), dtype=bool)
+    for ring in as_rings(rings):
+        ring = np.asarray(ring, dtype=float)
+        y1, x1 = ring[:, 0], ring[:, 1]
+        y2, x2 = np.roll(y1, -1), np.roll(x1, -1)
+        for j in range(len(ring)):
+            crosses = (y1[j] > lats) != (y2[j] > lats)
+            if not crosses.any():
+                continue
+            x_at = x1[j] + (lats[crosses] - y1[j]) * (x2[j] - x1[j]) / \
+                (y2[j] - y1[j])
+            inside[crosses] ^= lons[crosses] < x_at
+    return inside
+
+
+class SpatialIndex(object):
+
+    def __init__(self, lats, lons, ids=None, points_per_cell=POINTS_PER_CELL):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        n = len(self.lats)
+        self.ids = np.asarray(ids, dtype=object) if ids is not None \
+            else np.arange(n)
+
+        if n:
+            self.min_lat, self.max_lat = self.lats.min(), self.lats.max()
+            self.min_lon, self.max_lon = self.lons.min(), self.lons.max()
+        else:
+            self.min_lat = self.max_lat = self.min_lon = self.max_lon = 0.
+        # Square-ish cells, about points_per_cell points each on average.
+        height = max(self.max_lat - self.min_lat, 1e-9)
+        width = max(self.max_lon - self.min_lon, 1e-9)
+        n_cells = max(1, n // points_per_cell)
+        self.cell = max(np.sqrt(height * width / n_cells), 1e-9)
+        self.n_rows = int(height // self.cell) + 1
+        self.n_cols = int(width // self.cell) + 1
+
+        cells = self.row_of(self.lats) * self.n_cols + self.col_of(self.lons)
+        self.order = np.argsort(cells, kind='stable')
+        self.cell_start = np.searchsorted(
+            cells[self.order], np.arange(self.n_rows * self.n_cols + 1))
+
+    @classmethod
+    def from_documents(cls, docs, query=None, **kwargs):
+        '''Index the documents with a pos, and matching query if given.'''
+        lats, lons, ids = [], [], []
+        for doc in docs:
+            pos = doc.get('pos')
+            if not pos or (query and not match(doc, query)):
+                continue
+            lats.append(pos[0])
+            lons.append(pos[1])
+            ids.append(doc.get('id'))
+        return cls(lats, lons, ids, **kwargs)
+
+    @classmethod
+    def from_json_lines(cls, file_in, query=None, **kwargs):
+        return cls.from_documents(iter_documents(file_in), query, **kwargs)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def row_of(self, lat):
+        rows = np.floor((np.asarray(lat) - self.min_lat) / self.cell)
+        return np.clip(rows, 0, self.n_rows - 1).astype(np.int64)
+
+    def col_of(self, lon):
+        cols = np.floor((np.asarray(lon) - self.min_lon) / self.cell)
+        return np.clip(cols, 0, self.n_cols - 1).astype(np.int64)
+
+    def candidates(self, min_lat, min_lon, max_lat, max_lon):
+        '''Points in the grid cells overlapping a bounding box.'''
+        if not len(self) or min_lat > self.max_lat or \
+                max_lat < self.min_lat or min_lon > self.max_lon or \
+                max_lon < self.min_lon:
+            return np.empty(0, dtype=np.int64)
+        r0, r1 = self.row_of(min_lat), self.row_of(max_lat)
+        c0, c1 = self.col_of(min_lon), self.col_of(max_lon)
+        # Within a row the cells c0..c1 are one contiguous run of order.
+        starts = self.cell_start[np.arange(r0, r1 + 1) * self.n_cols + c0]
+        ends = self.cell_start[np.arange(r0, r1 + 1) * self.n_cols + c1 + 1]
+        return np.concatenate([self.order[s:e] for s, e in zip(starts, ends)])
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon):
+        '''Positions of the points inside a bounding box.'''
+        found = self.candidates(min_lat, min_lon, max_lat, max_lon)
+        lats, lons = self.lats[found], self.lons[found]
+        keep = (lats >= min_lat) & (lats <= max_lat) & \
+            (lons >= min_lon) & (lons <= max_lon)
+        return np.sort(found[keep])
+
+    def radius(self, lat, lon, metres):
+        '''Positions of the points within metres of (lat, lon), nearest first.'''
+        dlat, dlon = degrees_around(lat, metres)
+        found = self.candidates(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        distances = haversine(lat, lon, self.lats[found], self.lons[found])
+        keep = distances <= metres
+        found, distances = found[keep], distances[keep]
+        return found[np.argsort(distances, kind='stable')]
+
+    def nearest(self, lat, lon, k=1):
+        '''Positions of the k points nearest to (lat, lon), nearest first.'''
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        half = self.cell
+        while True:
+            found = self.candidates(lat - half, lon - half, lat + half,
+                                    lon + half)
+            if len(found) >= k or half > 360:
+                break
+            half *= 2
+        distances = haversine(lat, lon, self.lats[found], self.lons[found])
+        # The box holds everything within the distance to its nearest edge;
+        # if the kth nearest candidate is further than that, something
+        # outside the box may be nearer, so search the full circle.
+        kth = np.partition(distances, k - 1)[k - 1]
+        # (1% off the edge distance covers the curvature of the meridians.)
+        edge = 0.99 * haversine(lat, lon, np.array([lat - half, lat]),
+                                np.array([lon, lon - half])).min()
+        if kth > edge:
+            return self.radius(lat, lon, kth)[:k]
+        best = np.argsort(distances, kind='stable')[:k]
+        return found[best]
+
+    def assign_polygons(self, polygons):
+        '''
+        Name of the polygon each point falls in (the first, if they
+        overlap), or None. polygons maps names to a ring of [lat, lon]
+        vertices, or a list of rings.
+        '''
+        names = list(polygons)
+        labels = np.full(len(self), -1, dtype=np.int64)
+        for label, name in enumerate(names):
+            rings = as_rings(polygons[name])
+            vertices = np.concatenate([np.asarray(ring, dtype=float)
+                                       for ring in rings])
+            found = self.bbox(vertices[:, 0].min(), vertices[:, 1].min(),
+                              vertices[:, 0].max(), vertices[:, 1].max())
+            found = found[labels[found] == -1]
+            inside = points_in_polygon(self.lats[found], self.lons[found],
+                                       rings)
+            labels[found[inside]] = label
+        return np.array(names + [None], dtype=object)[labels]
+
+
+def load_boundaries(file_in, query={'boundary': 'administrative'}):
+    '''
+    {name: ring} for the closed ways matching query in a process_map output
+    written with geometry=True.
+    '''
+    polygons = {}
+    for doc in iter_documents(file_in):
+        ring = doc.get('node_pos')
+        if ring and len(ring) > 3 and ring[0] == ring[-1] and \
+                'name' in doc and match(doc, query):
+            polygons.setdefault(doc['name'], []).append(ring)
+    return polygons
+
+
+def test():
+    import time
+    rnd = np.random.RandomState(0)
+    n = 1000000
+    index = SpatialIndex(43.58 + rnd.rand(n) * 0.28, -79.64 + rnd.rand(n) * 0.52)
+    for name, func in [
+            ('bbox', lambda: index.bbox(43.64, -79.40, 43.66, -79.37)),
+            ('radius 500m', lambda: index.radius(43.6532, -79.3832, 500)),
+            ('nearest 10', lambda: index.nearest(43.6532, -79.3832, 10)),
+            ('townships', lambda: index.assign_polygons({
+                'Old Toronto': [[43.63, -79.47], [43.70, -79.47],
+                                [43.70, -79.30], [43.63, -79.30]]}))]:
+        start = time.time()
+        result = func()
+        print("{:>12}: {:8.2f} ms, {:d} results".format(
+            name, 1000 * (time.time() - start), len(result)))
+
+
+if __name__ == '__main__':
+    test()
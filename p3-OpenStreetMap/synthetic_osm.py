@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Deterministic synthetic OSM extracts, so the audits, process_map and the
+benchmarks can run without downloading toronto_canada.osm.
+
+The same seed always gives the same file. The file has:
+- nodes in and around Toronto, some of them points of interest with a name,
+  amenity, address, phone and opening_hours
+- ways over earlier nodes, for streets and buildings
+- relations over earlier ways
+
+Tag values come in the dirty shapes the cleaning code has to deal with:
+abbreviated and lower-case street types, abbreviated cardinal directions,
+phones in every punctuation, opening hours in free text, and keys with
+problem characters.
+
+Usage: python synthetic_osm.py n_nodes [file] [seed]
+'''
+import random
+import sys
+from xml.sax.saxutils import quoteattr
+
+from format_hours import test_data as hours_data
+
+STREET_NAMES = ['Yonge', 'Queen', 'King', 'Bloor', 'Dundas', 'Spadina',
+                'College', 'Bathurst', 'Eglinton', 'Lake Shore', 'Sheppard',
+                'Finch', 'Don Mills', 'Jane', 'Kingston', 'Front', 'Bay',
+                'St. Clair', 'Danforth', 'Ossington']
+
+STREET_TYPES = ['Street', 'Street', 'St', 'St.', 'ST', 'street', 'Avenue',
+                'Avenue', 'Ave', 'Ave.', 'avenue', 'Road', 'Rd', 'Rd.',
+                'Boulevard', 'Blvd', 'Drive', 'Dr', 'Dr.', 'Crescent',
+                'Trail', 'Trl', 'Court', 'Lane', 'Way', 'Gate', 'Terrace']
+
+CARDINAL_SUFFIXES = ['', '', '', '', ' East', ' West', ' North', ' South',
+                     ' E', ' W', ' N', ' S', ' E.', ' W.']
+
+CITIES = ['Toronto', 'Toronto', 'City of Toronto', 'city of Toronto',
+          'Markham', 'City of Vaughan', 'Mississauga', 'Richmond Hill',
+          'toronto', 'North York']
+
+AMENITIES = ['cafe', 'restaurant', 'fast_food', 'bank', 'pharmacy', 'pub',
+             'school', 'parking', 'bench', 'post_box', 'dentist', 'library']
+
+PHONE_FORMATS = ['{a}-{b}-{c}', '({a}) {b}-{c}', '+1 {a} {b} {c}',
+                 '{a}.{b}.{c}', '{a}{b}{c}', '1-{a}-{b}-{c}',
+                 '+1-{a}-{b}-{c}', '{a}-{b}-{c} ext. {x}', '{a} {b} {c} x {x}',
+                 '+1 ({a}) {b}-{c}', '{b}-{c}']
+
+BAD_PHONES = ['garbage', 'none', '+44 20 7946 0958', '416-CALL-NOW']
+
+EXTRA_HOURS = ['Mo-Fr 9:00-17:00', 'Mo-Su 07:00-23:00', 'Sa-Su 10:00-16:00',
+               'Monday-Friday 9:00-17:00', 'Mo-Fr 08:00-20:00, Sa 9:00-18:00',
+               'Tu-Su 11:00-22:00; Mo off', 'Mo-Fr 7:30-19:00 | Sa 8:00-17:00',
+               'by appointment']
+
+PROBLEM_KEYS = ['fixme?', 'name ', 'addr:street:name', 'note/1',
+                'building:levels:underground', 'is_in:city']
+
+USERS = ['andrewpmk', 'MikeN', 'Kevo', 'Bootprint', 'rw__', 'Zed',
+         'linuxUser16', 'TristanA']
+
+HIGHWAYS = ['residential', 'residential', 'service', 'footway', 'primary',
+            'secondary', 'tertiary', 'cycleway']
+
+# Toronto and the surrounding municipalities
+BBOX = (43.58, -79.64, 43.86, -79.12)
+
+
+class SyntheticOSM(object):
+
+    def __init__(self, seed=0, tag_rate=0.25):
+        self.rnd = random.Random(seed)
+        self.tag_rate = tag_rate
+        self.next_id = 1
+        self.n_nodes = 0
+        self.last_node = 0
+        self.way_ids = []
+
+    def street(self):
+        rnd = self.rnd
+        return '{} {}{}'.format(rnd.choice(STREET_NAMES),
+                                rnd.choice(STREET_TYPES),
+                                rnd.choice(CARDINAL_SUFFIXES))
+
+    def phone(self):
+        rnd = self.rnd
+        if rnd.random() < 0.05:
+            return rnd.choice(BAD_PHONES)
+        return rnd.choice(PHONE_FORMATS).format(
+            a=rnd.choice(['416', '647', '905', '437']),
+            b='{:03d}'.format(rnd.randint(200, 999)),
+            c='{:04d}'.format(rnd.randint(0, 9999)),
+            x=rnd.randint(1, 999))
+
+    def hours(self):
+        return self.rnd.choice(hours_data + EXTRA_HOURS)
+
+    def address(self):
+        rnd = self.rnd
+        tags = [('addr:housenumber', str(rnd.randint(1, 3000))),
+                ('addr:street', self.street())]
+        if rnd.random() < 0.7:
+            tags.append(('addr:city', rnd.choice(CITIES)))
+        if rnd.random() < 0.3:
+            tags.append(('addr:postcode', 'M{}{} {}{}{}'.format(
+                rnd.randint(1, 9), rnd.choice('ABCEGHJKLMNPRSTVWXYZ'),
+                rnd.randint(0, 9), rnd.choice('ABCEGHJKLMNPRSTVWXYZ'),
+                rnd.randint(0, 9))))
+        return tags
+
+    def poi_tags(self):
+        rnd = self.rnd
+        amenity = rnd.choice(AMENITIES)
+        tags = [('amenity', amenity),
+                ('name', '{} {}'.format(rnd.choice(STREET_NAMES),
+                                        amenity.replace('_', ' ').title()))]
+        if rnd.random() < 0.6:
+            tags += self.address()
+        if rnd.random() < 0.4:
+            tags.append(('phone', self.phone()))
+        if rnd.random() < 0.3:
+            tags.append(('opening_hours', self.hours()))
+        if rnd.random() < 0.1:
+            tags.append((rnd.choice(PROBLEM_KEYS), 'yes'))
+        return tags
+
+    def way_tags(self):
+        rnd = self.rnd
+        if rnd.random() < 0.5:
+            tags = [('highway', rnd.choice(HIGHWAYS)),
+                    ('name', self.street())]
+        else:
+            tags = [('building', 'yes')]
+            if rnd.random() < 0.5:
+                tags += self.address()
+        if rnd.random() < 0.05:
+            tags.append((rnd.choice(PROBLEM_KEYS), 'yes'))
+        return tags
+
+    def attributes(self, element_id):
+        rnd = self.rnd
+        uid = rnd.randrange(len(USERS))
+        return ('id="{}" version="{}" changeset="{}" '
+                'timestamp="20{:02d}-{:02d}-{:02d}T{:02d}:{:02d}:00Z" '
+                'user={} uid="{}"').format(
+            element_id, rnd.randint(1, 6), rnd.randint(100000, 40000000),
+            rnd.randint(8, 16), rnd.randint(1, 12), rnd.randint(1, 28),
+            rnd.randint(0, 23), rnd.randint(0, 59), quoteattr(USERS[uid]),
+            1000 + uid)
+
+    def take_id(self):
+        element_id = self.next_id
+        self.next_id += 1
+        return element_id
+
+    def node(self):
+        rnd = self.rnd
+        element_id = self.take_id()
+        self.n_nodes += 1
+        self.last_node = element_id
+        head = ' <node {} lat="{:.7f}" lon="{:.7f}"'.format(
+            self.attributes(element_id),
+            rnd.uniform(BBOX[0], BBOX[2]), rnd.uniform(BBOX[1], BBOX[3]))
+        if rnd.random() >= self.tag_rate:
+            return head + '/>\n'
+        return head + '>\n' + format_tags(self.poi_tags()) + ' </node>\n'
+
+    def way(self):
+        rnd = self.rnd
+        element_id = self.take_id()
+        self.way_ids.append(element_id)
+        # Nearby ids, as in real extracts where a way's nodes were mapped
+        # together.
+        first = rnd.randint(1, max(1, self.last_node - 8))
+        refs = [min(self.last_node, first + i)
+                for i in range(rnd.randint(2, 8))]
+        if refs[0] != refs[-1] and rnd.random() < 0.3:
+            refs.append(refs[0])
+        return ' <way {}>\n{}{} </way>\n'.format(
+            self.attributes(element_id),
+            ''.join('  <nd ref="{}"/>\n'.format(ref) for ref in refs),
+            format_tags(self.way_tags()))
+
+    def relation(self):
+        rnd = self.rnd
+        element_id = self.take_id()
+        members = rnd.sample(self.way_ids, min(len(self.way_ids),
+                                               rnd.randint(1, 4)))
+        return ' <relation {}>\n{}{} </relation>\n'.format(
+            self.attributes(element_id),
+            ''.join('  <member type="way" ref="{}" role="outer"/>\n'.format(m)
+                    for m in members),
+            format_tags([('type', 'multipolygon')]))
+
+
+def format_tags(tags):
+    return ''.join('  <tag k={} v={}/>\n'.format(quoteattr(k), quoteattr(v))
+                   for k, v in tags)
+
+
+def write_synthetic_osm(file_out, n_nodes=10000, n_ways=None,
+                        n_relations=None, tag_rate=0.25, seed=0,
+                        size_mb=None):
+    '''
+    Write a synthetic OSM file with n_nodes nodes, n_ways ways (n_nodes / 8
+    by default) and n_relations relations (n_ways / 50 by default), where
+    tag_rate of the nodes are tagged points of interest. With size_mb the
+    counts are ignored, and nodes then ways are written until the file
+    reaches about that size.
+    Returns the number of top level elements written.
+    '''
+    gen = SyntheticOSM(seed, tag_rate)
+    if n_ways is None:
+        n_ways = n_nodes // 8
+    if n_relations is None:
+        n_relations = n_ways // 50
+
+    with open(file_out, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<osm version="0.6" generator="synthetic_osm">\n'
+                ' <bounds minlat="{}" minlon="{}" maxlat="{}" maxlon="{}"/>\n'
+                .format(*BBOX))
+        if size_mb is None:
+            for _ in range(n_nodes):
+                f.write(gen.node())
+            # Ways need nodes to refer to.
+            for _ in range(n_ways if n_nodes else 0):
+                f.write(gen.way())
+            for _ in range(n_relations):
+                f.write(gen.relation())
+        else:
+            target = size_mb * 1024 * 1024
+            while f.tell() < target * 8 // 10:
+                f.write(gen.node())
+            while f.tell() < target:
+                f.write(gen.way())
+        f.write('</osm>\n')
+    return gen.next_id - 1
+
+
+if __name__ == '__main__':
+    n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    file_out = sys.argv[2] if len(sys.argv) > 2 else 'synthetic.osm'
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    print(write_synthetic_osm(file_out, n_nodes, seed=seed), "elements")